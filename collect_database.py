@@ -1,110 +1,449 @@
 # Author: Jordan Morris and Victor Vu
 # File: collect_database.py
-# Description: Adds a connection to MySQL and fetches data from the database
+# Description: Connects to the configured storage backend and fetches data from the database
 # Copyright (C) 2024 Victor V. Vu and Jordan Morris
 # License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
-import pymysql
+import numpy as np
 from dotenv import load_dotenv
+import asyncio
+import csv
+import functools
+import math
 import os
-from urllib.parse import urlparse
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from downsample import lttb_series, step_resample
+from storage import get_backend, DEFAULT_TANK_ID, ROLLUP_TABLES, STREAM_CHUNK_SIZE
+from storage.archive import ParquetArchive
+from storage.base import as_datetime, local_timestamp
 
 
 def env_reuse():  # Reuse loaded .env instead of recreating in other files
     load_dotenv()  # load environment variables from .env (not uploaded here)
 
 
-# Parse database URL from .env file
+# Parse database URL from .env file (mysql://... or sqlite:///path/to/file.db)
 env_reuse()
 db_url = os.getenv("DATABASE_URL")
-parsed_url = urlparse(db_url)
 
+# Pool settings (can be overridden in .env, MySQL only)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # max open connections
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
 
-def create_connection():  # Establish MySQL connection
-    return pymysql.connect(
-        host=parsed_url.hostname,
-        user=parsed_url.username,
-        password=parsed_url.password,
-        database=parsed_url.path[1:],
-        port=parsed_url.port,
-        autocommit=True,  # autocommit to refresh data
-    )
+SENSOR_INTERVAL = 300  # seconds between sensor writes (SENSOR_INTERVAL in sensors/connect_timer.py)
+LATEST_CACHE_TTL = SENSOR_INTERVAL  # latest readings can only change once per sensor interval
+LATEST_CACHE_RETRY = 30  # seconds before retrying a failed background refresh
+GRAPH_POINTS = 500  # default number of points per sensor returned for graphs
+RANGE_CACHE_MB = float(os.getenv("RANGE_CACHE_MB", "64"))  # memory budget for cached history
+RANGE_CACHE_ID_OVERLAP = 1000  # recent ids the range cache reads again on every refresh
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")  # Parquet files of months moved out by retention.py
+TANK_ID = os.getenv("TANK_ID", DEFAULT_TANK_ID)  # tank shown by this app (tank_id=None: every tank, keyed by (tank_id, sensor_type))
+# Sensors skip readings inside their deadband but store one at least every HEARTBEAT_MINUTES (sensors/deadband.py)
+HEARTBEAT_MINUTES = float(os.getenv("HEARTBEAT_MINUTES", "60"))
+MAX_HOLD = HEARTBEAT_MINUTES * 60 + SENSOR_INTERVAL  # longer gaps are outages, not unchanged values
+
+backend = get_backend(db_url, pool_size=POOL_SIZE, pool_timeout=POOL_TIMEOUT)  # connections open lazily
+# Dedicated threads for blocking queries, sized so every worker can hold a pooled connection
+db_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+archive = ParquetArchive(ARCHIVE_DIR)  # cold tier, older than anything left in the database
+
+
+async def run_in_db_executor(func, *args, **kwargs):  # Await a blocking query off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+def get_latest_data(tank_id=TANK_ID):  # Fetch latest sensor data for each type
+    return backend.latest(tank_id)
+
+
+def for_every_tank(query, *args):  # Run a per-tank query for each tank, keys become (tank_id, sensor_type)
+    return {(tank_id, key): value for tank_id in backend.tanks() for key, value in query(*args, tank_id=tank_id).items()}
 
 
-def get_connection(): # Check if connection is still active
-    global connection
-    try:
-        connection.ping(reconnect=True)
-    except (AttributeError, pymysql.MySQLError):
-        connection = create_connection()
-    return connection
-
-
-connection = create_connection() # create a connection object
-
-
-def get_latest_data():  # Fetch latest sensor data for each type
-    conn = get_connection()
-    with conn.cursor() as cursor:  # Create a cursor object
-        cursor.execute("SET time_zone = '-09:00';")  # set timezone to PST (-1/2 hrs for daylight savings)
-        # Execute a query to fetch data
-        cursor.execute("""
-            SELECT sd.sensor_type, sd.value, sd.timestamp
-            FROM sensor_data sd
-            JOIN (
-                SELECT sensor_type, MAX(timestamp) AS max_timestamp
-                FROM sensor_data
-                GROUP BY sensor_type
-            ) latest
-            ON sd.sensor_type = latest.sensor_type AND sd.timestamp = latest.max_timestamp
-        """)
-        results = cursor.fetchall()  # fetch all rows
-        sensor_data = {
-            row[0]: {"value": row[1], "timestamp": row[2]} for row in results
-        }  # store data in a dictionary
-        return sensor_data
+def iter_all_data(
+    start_date=None, end_date=None, chunk_size=STREAM_CHUNK_SIZE, tank_id=TANK_ID
+):  # Stream (sensor_type, value, timestamp) rows in chunks with bounded memory
+    start, end = as_datetime(start_date), as_datetime(end_date)
+    archive_end = archive.end()
+    if archive_end is None:  # nothing archived yet
+        yield from backend.iter_range(start_date, end_date, chunk_size, tank_id)
+        return
+    if start is None or start < archive_end:  # cold tier first, it holds the older months
+        yield from archive.iter_range(start, end, chunk_size, tank_id)
+    if end is None or end >= archive_end:  # database rows of archived months are skipped
+        yield from backend.iter_range(max(start or archive_end, archive_end), end, chunk_size, tank_id)
 
 
 def get_all_data(
-    start_date=None, end_date=None
+    start_date=None, end_date=None, tank_id=TANK_ID
 ):  # Fetch all  data within a specified range
-    conn = get_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("SET time_zone = '-08:00';")
-        if (
-            start_date is None or end_date is None
-        ):  # Fetch min and max timestamps if no range provided
-            cursor.execute("""
-                SELECT MIN(timestamp), MAX(timestamp)
-                FROM sensor_data
-            """)
-            min_timestamp, max_timestamp = cursor.fetchone()
-            start_date = (
-                start_date or min_timestamp
-            )  # set start date to min timestamp if not provided
-            end_date = (
-                end_date or max_timestamp
-            )  # set end date to max timestamp if not provided
-
-        # Fetch data within the specified date range
-        cursor.execute(
-            """
-            SELECT sensor_type, value, timestamp
-            FROM sensor_data
-            WHERE timestamp BETWEEN %s AND %s
-            ORDER BY timestamp
-        """,
-            (start_date, end_date),
-        )  # pass in the start and end date
-        results = cursor.fetchall()  # fetch all rows
-        sensor_data = {}  # empty dictionary to store data
-
-        for row in results:  # Iterate each row and store in dictionary
-            sensor_type = row[0]  # sensor type
+    if tank_id is None:
+        return for_every_tank(get_all_data, start_date, end_date)
+    sensor_data = {}  # empty dictionary to store data
+    for rows in iter_all_data(start_date, end_date, tank_id=tank_id):  # Store each chunk in the dictionary
+        for sensor_type, value, timestamp in rows:
             if (
                 sensor_type not in sensor_data
             ):  # check if sensor type is in the dictionary
                 sensor_data[sensor_type] = []  # create a list for each sensor type
             sensor_data[sensor_type].append(
-                {"value": row[1], "timestamp": row[2]}
+                {"value": value, "timestamp": timestamp}
             )  # append data to the list
-        return sensor_data
+    return sensor_data
+
+
+def get_all_data_arrays(
+    start_date=None, end_date=None, tank_id=TANK_ID
+):  # Fetch a range as {sensor_type: (datetime64 timestamps, float64 values)}
+    if tank_id is None:
+        return for_every_tank(get_all_data_arrays, start_date, end_date)
+    return rows_to_arrays(iter_all_data(start_date, end_date, tank_id=tank_id))
+
+
+def rows_to_arrays(row_chunks):  # Chunks of (sensor_type, value, timestamp) rows -> {sensor_type: (timestamps, values)}
+    chunks = {}  # sensor_type -> list of (timestamps, values) array pairs
+    for rows in row_chunks:  # Convert each chunk column-wise
+        sensor_types, values, timestamps = zip(*rows)
+        sensor_types = np.array(sensor_types, dtype=object)
+        values = np.array(values, dtype=np.float64)
+        timestamps = np.array(timestamps, dtype="datetime64[us]")
+        for sensor_type in dict.fromkeys(sensor_types):  # unique types, in order of appearance
+            mask = sensor_types == sensor_type
+            chunks.setdefault(sensor_type, []).append((timestamps[mask], values[mask]))
+    return {  # one contiguous pair of arrays per sensor type
+        sensor_type: (
+            np.concatenate([pair[0] for pair in pairs]),
+            np.concatenate([pair[1] for pair in pairs]),
+        )
+        for sensor_type, pairs in chunks.items()
+    }
+
+
+def get_step_data_arrays(
+    start_date=None, end_date=None, interval=SENSOR_INTERVAL, tank_id=TANK_ID
+):  # Fetch a range on a regular grid, holding the last stored value over deadband gaps (NaN in outages)
+    if tank_id is None:
+        return for_every_tank(get_step_data_arrays, start_date, end_date, interval)
+    start, end = _as_datetime64(start_date), _as_datetime64(end_date)
+    # Readings from up to MAX_HOLD before the range give the value held at its start
+    lookback = None if start is None else (start - np.timedelta64(int(MAX_HOLD), "s")).astype(object)
+    data = (
+        range_cache.get(lookback, end_date)
+        if tank_id == TANK_ID
+        else get_all_data_arrays(lookback, end_date, tank_id)
+    )
+    if end is None:  # the last stored value still holds now
+        end = np.datetime64(local_timestamp(), "us")
+    return {
+        sensor_type: step_resample(timestamps, values, interval, start, end, MAX_HOLD)
+        for sensor_type, (timestamps, values) in data.items()
+    }
+
+
+def export_csv(file, start_date=None, end_date=None, tank_id=TANK_ID):  # Write a range to an open CSV file
+    if tank_id is not None:
+        backend.export_csv(file, start_date, end_date, tank_id)
+        return
+    writer = csv.writer(file)  # every tank: rows carry their tank_id
+    writer.writerow(["tank_id", "sensor_type", "value", "timestamp"])
+    for tank in backend.tanks():
+        for rows in backend.iter_range(start_date, end_date, tank_id=tank):
+            writer.writerows((tank, *row) for row in rows)
+
+
+def get_downsampled_data(
+    start_date=None, end_date=None, target_points=GRAPH_POINTS, method="bucket", tank_id=TANK_ID
+):  # Fetch at most ~target_points readings per sensor type for a range
+    if tank_id is None:
+        return for_every_tank(get_downsampled_data, start_date, end_date, target_points, method)
+    if method == "lttb":  # keep visually important points, reduced with NumPy
+        data = (  # no per-row dicts for dropped points
+            range_cache.get(start_date, end_date)
+            if tank_id == TANK_ID
+            else get_all_data_arrays(start_date, end_date, tank_id)
+        )
+        return {
+            sensor_type: lttb_series(timestamps, values, target_points)
+            for sensor_type, (timestamps, values) in data.items()
+        }
+
+    # Otherwise average fixed-width time buckets in SQL, keeping the min/max of each
+    first, last = get_extent(start_date, end_date, tank_id)  # actual extent of the data in the range
+    if first is None:  # no readings in the range
+        return {}
+    bucket_seconds = max(1, math.ceil((last - first).total_seconds() / target_points))
+
+    # Long ranges read the coarsest rollup that still fits the bucket width (rollups keep archived months)
+    rollups = [table for table, width in ROLLUP_TABLES.values() if width <= bucket_seconds]
+    start, end = as_datetime(start_date), as_datetime(end_date)
+    archive_end = archive.end()
+    if rollups or archive_end is None or (start is not None and start >= archive_end):
+        rows = backend.buckets(
+            start_date, end_date, first, bucket_seconds, rollups[-1] if rollups else None, tank_id
+        )
+    else:  # raw buckets of archived months come from the Parquet files, like iter_all_data
+        rows = archive_buckets(start, end, first, bucket_seconds, tank_id)
+        if end is None or end >= archive_end:
+            rows += backend.buckets(max(start or archive_end, archive_end), end, first, bucket_seconds, None, tank_id)
+    sensor_data = {}
+    for sensor_type, timestamp, avg_value, min_value, max_value in rows:
+        sensor_data.setdefault(sensor_type, []).append(
+            {
+                "value": float(avg_value),
+                "timestamp": timestamp,  # earliest timestamp in the bucket
+                "min": float(min_value),
+                "max": float(max_value),
+            }
+        )
+    return {  # deadband gaps show the held value instead of being skipped on the graph
+        sensor_type: hold_empty_buckets(entries, first, bucket_seconds)
+        for sensor_type, entries in sensor_data.items()
+    }
+
+
+def get_extent(start_date=None, end_date=None, tank_id=TANK_ID):  # (first, last) timestamp across both tiers
+    start, end = as_datetime(start_date), as_datetime(end_date)
+    archive_end = archive.end()
+    if archive_end is None:  # nothing archived yet
+        return backend.extent(start_date, end_date, tank_id)
+    first = last = None
+    if start is None or start < archive_end:
+        first, last = archive.extent(start, end, tank_id)
+    if end is None or end >= archive_end:  # database rows of archived months are skipped
+        hot_first, hot_last = backend.extent(max(start or archive_end, archive_end), end, tank_id)
+        first, last = first or hot_first, hot_last or last
+    return first, last
+
+
+def archive_buckets(
+    start_date, end_date, origin, bucket_seconds, tank_id=TANK_ID
+):  # Same (sensor_type, timestamp, avg, min, max) rows as backend.buckets, from archived months
+    rows = []
+    arrays = rows_to_arrays(archive.iter_range(start_date, end_date, tank_id=tank_id))
+    for sensor_type, (timestamps, values) in arrays.items():
+        index = (timestamps - np.datetime64(origin, "us")) // np.timedelta64(bucket_seconds, "s")
+        starts = np.flatnonzero(np.diff(index, prepend=index[0] - 1))  # first row of each bucket
+        counts = np.diff(np.append(starts, len(values)))
+        rows.extend(
+            zip(
+                [sensor_type] * len(starts),
+                timestamps[starts].astype(object),  # earliest timestamp in the bucket
+                np.add.reduceat(values, starts) / counts,
+                np.minimum.reduceat(values, starts),
+                np.maximum.reduceat(values, starts),
+            )
+        )
+    return sorted(rows, key=lambda row: row[1])
+
+
+def hold_empty_buckets(entries, origin, bucket_seconds):  # Repeat a bucket's value over empty buckets up to MAX_HOLD
+    filled = []
+    for entry in entries:
+        if filled:
+            previous = filled[-1]
+            gap = (entry["timestamp"] - previous["timestamp"]).total_seconds()
+            index = (previous["timestamp"] - origin).total_seconds() // bucket_seconds
+            last = (entry["timestamp"] - origin).total_seconds() // bucket_seconds
+            if gap <= MAX_HOLD:  # longer gaps are outages and stay empty
+                while index + 1 < last:
+                    index += 1
+                    filled.append(
+                        {
+                            "value": previous["value"],
+                            "timestamp": origin + timedelta(seconds=index * bucket_seconds),
+                            "min": previous["value"],
+                            "max": previous["value"],
+                        }
+                    )
+        filled.append(entry)
+    return filled
+
+
+def get_statistics(
+    start_date=None, end_date=None, granularity="hourly", tank_id=TANK_ID
+):  # Count/min/max/mean/stddev per sensor type, read from the rollup tables
+    if tank_id is None:
+        return for_every_tank(get_statistics, start_date, end_date, granularity)
+    statistics = {}
+    for sensor_type, count, min_value, max_value, total, squares in backend.rollup_totals(
+        start_date, end_date, granularity, tank_id
+    ):
+        count, total, squares = int(count), float(total), float(squares)
+        mean = total / count
+        statistics[sensor_type] = {
+            "count": count,
+            "min": float(min_value),
+            "max": float(max_value),
+            "mean": mean,
+            "stddev": math.sqrt(max(0.0, squares / count - mean * mean)),
+        }
+    return statistics
+
+
+async def get_latest_data_async(tank_id=TANK_ID):  # Non-blocking get_latest_data for UI callbacks
+    return await run_in_db_executor(get_latest_data, tank_id)
+
+
+async def get_all_data_async(start_date=None, end_date=None, tank_id=TANK_ID):  # Non-blocking get_all_data
+    return await run_in_db_executor(get_all_data, start_date, end_date, tank_id)
+
+
+async def get_downsampled_data_async(
+    start_date=None, end_date=None, target_points=GRAPH_POINTS, method="bucket", tank_id=TANK_ID
+):  # Non-blocking get_downsampled_data
+    return await run_in_db_executor(
+        get_downsampled_data, start_date, end_date, target_points, method, tank_id
+    )
+
+
+class LatestReadingCache:  # Process-wide cache of the latest reading per sensor type of TANK_ID
+    def __init__(self, ttl=LATEST_CACHE_TTL):
+        self.ttl = ttl
+        self._data = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()  # only one thread queries on a cache miss
+        self._task = None
+
+    def is_fresh(self):
+        return self._data is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def refresh(self):  # Query the database and replace the cached readings
+        data = get_latest_data()
+        self._data, self._fetched_at = data, time.monotonic()
+        return data
+
+    def get(self):  # Cached readings, refreshed at most once per ttl
+        if self.is_fresh():
+            return self._data
+        with self._lock:
+            if not self.is_fresh():  # another thread may have refreshed while we waited
+                self.refresh()
+            return self._data
+
+    async def get_async(self):  # Non-blocking get() for UI callbacks
+        if self.is_fresh():
+            return self._data
+        return await run_in_db_executor(self.get)
+
+    def invalidate(self):  # Force the next get() to query again (e.g. after new data is written)
+        self._fetched_at = 0.0
+
+    async def refresh_forever(self):  # Background task keeping the cache warm
+        while True:
+            try:
+                await run_in_db_executor(self.get)
+                delay = self.ttl - (time.monotonic() - self._fetched_at)  # until the cache expires
+            except Exception as e:  # keep serving the last readings until the next try
+                print(f"Error refreshing latest readings: {e}")
+                delay = LATEST_CACHE_RETRY
+            await asyncio.sleep(max(1.0, delay))
+
+    def start(self):  # Start the single background refresher (call from the running event loop)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.refresh_forever())
+
+
+latest_cache = LatestReadingCache()  # shared by every connected client
+
+
+def _as_datetime64(value):  # Date bound ("2025/01/12", datetime, ...) -> datetime64, None stays None
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.replace("/", "-")
+    return np.datetime64(value, "us")
+
+
+class RangeCache:  # Process-wide copy of TANK_ID's sensor history that only fetches newly inserted rows
+    def __init__(self, max_mb=RANGE_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._series = {}  # sensor_type -> (timestamps, values), read-only arrays
+        self._loaded = False
+        self._low_water = None  # cache holds every row from here on (None = full history)
+        self._last_id = 0  # highest sensor_data id fetched, late rows with old timestamps still get new ids
+        self._lock = threading.Lock()  # one refresh at a time, readers see a consistent copy
+
+    def get(self, start_date=None, end_date=None):  # Same result as get_all_data_arrays(start, end)
+        start, end = _as_datetime64(start_date), _as_datetime64(end_date)
+        if self._low_water is not None and (start is None or start < self._low_water):
+            return get_all_data_arrays(start_date, end_date)  # evicted history, ask the database
+        with self._lock:
+            self._refresh()
+            series = dict(self._series)
+        result = {}
+        for sensor_type, (timestamps, values) in series.items():
+            lo = 0 if start is None else np.searchsorted(timestamps, start, "left")
+            hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, "right")
+            if hi > lo:
+                result[sensor_type] = (timestamps[lo:hi], values[lo:hi])
+        return result
+
+    def invalidate(self):  # Drop everything, the next get() loads the full history again
+        with self._lock:
+            self._series, self._loaded = {}, False
+            self._low_water, self._last_id = None, 0
+
+    def nbytes(self):
+        return sum(ts.nbytes + values.nbytes for ts, values in self._series.values())
+
+    def _refresh(self):  # Load the full history once, afterwards only rows inserted since (any timestamp)
+        if not self._loaded:
+            self._last_id = backend.max_id()  # taken first, rows inserted during the load are fetched again
+            delta, self._loaded = get_all_data_arrays(), True
+        else:  # recent ids are read again, a transaction may commit after a later id was already read
+            rows = backend.rows_since(max(0, self._last_id - RANGE_CACHE_ID_OVERLAP), TANK_ID)
+            if not rows:
+                return
+            self._last_id = max(self._last_id, rows[-1][0])
+            delta = rows_to_arrays([[row[1:] for row in rows]])
+
+        for sensor_type, (new_timestamps, new_values) in delta.items():
+            timestamps, values = self._series.get(
+                sensor_type, (np.empty(0, "datetime64[us]"), np.empty(0, np.float64))
+            )
+            new_timestamps, new_values = self._new_rows(timestamps, values, new_timestamps, new_values)
+            if not len(new_timestamps):
+                continue
+            late = len(timestamps) and new_timestamps[0] < timestamps[-1]  # new rows are sorted by _new_rows
+            timestamps = np.concatenate([timestamps, new_timestamps])
+            values = np.concatenate([values, new_values])
+            if late:
+                order = np.argsort(timestamps, kind="stable")  # late rows go back in time order
+                timestamps, values = timestamps[order], values[order]
+            timestamps.flags.writeable = values.flags.writeable = False  # shared with every caller
+            self._series[sensor_type] = (timestamps, values)
+        self._evict()
+
+    def _new_rows(self, timestamps, values, new_timestamps, new_values):  # Drop rows already cached or evicted
+        order = np.argsort(new_timestamps, kind="stable")
+        new_timestamps, new_values = new_timestamps[order], new_values[order]
+        lo = np.searchsorted(timestamps, new_timestamps, "left")
+        hi = np.searchsorted(timestamps, new_timestamps, "right")
+        keep = np.ones(len(new_timestamps), dtype=bool)
+        single = hi - lo == 1  # usual case, one cached row at that timestamp
+        keep[single] = values[lo[single]] != new_values[single]
+        for i in np.flatnonzero(hi - lo > 1):  # several cached rows share the timestamp
+            keep[i] = new_values[i] not in values[lo[i]:hi[i]]
+        if self._low_water is not None:
+            keep &= new_timestamps >= self._low_water  # older rows are served by the database
+        return new_timestamps[keep], new_values[keep]
+
+    def _evict(self):  # Trim the oldest rows until the cache fits its memory budget
+        total = self.nbytes()
+        if total <= self.max_bytes:
+            return
+        all_timestamps = np.sort(np.concatenate([ts for ts, _ in self._series.values()]))
+        keep = int(len(all_timestamps) * self.max_bytes / total)  # rows that fit the budget
+        cutoff = all_timestamps[len(all_timestamps) - keep] if keep else all_timestamps[-1]
+        for sensor_type, (timestamps, values) in self._series.items():
+            lo = np.searchsorted(timestamps, cutoff, "left")
+            self._series[sensor_type] = (timestamps[lo:].copy(), values[lo:].copy())
+            for array in self._series[sensor_type]:
+                array.flags.writeable = False
+        self._low_water = cutoff
+
+
+range_cache = RangeCache()  # shared by the graphs (LTTB) and prediction pages (get_step_data_arrays)
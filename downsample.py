@@ -0,0 +1,106 @@
+# Author: Victor Vu and Jordan Morris
+# File: downsample.py
+# Description: Reduces long sensor series to a bounded number of points for graphing
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import numpy as np
+
+
+def lttb(x, y, target_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, for every bucket in between, the point
+    forming the largest triangle with the previously kept point and the average
+    of the next bucket. Peaks and dips survive, unlike plain averaging.
+
+    Args:
+        x (np.ndarray): Increasing x values (e.g. epoch seconds).
+        y (np.ndarray): Values at each x.
+        target_points (int): Number of points to keep.
+
+    Returns:
+        np.ndarray: Indices of the kept points, in increasing order.
+    """
+    n = len(x)
+    if target_points >= n or target_points < 3:  # nothing to reduce
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, target_points - 1).astype(np.intp)  # bucket edges excluding end points
+    indices = np.empty(target_points, dtype=np.intp)
+    indices[0], indices[-1] = 0, n - 1
+
+    a = 0  # index of the previously kept point
+    for i in range(target_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):  # average of the next bucket
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:  # last bucket looks ahead to the final point
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Triangle areas (x2) for every candidate in the current bucket
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def lttb_series(timestamps, values, target_points):
+    """
+    Applies LTTB to a sensor series.
+
+    Args:
+        timestamps (np.ndarray): datetime64 reading timestamps in increasing order.
+        values (np.ndarray): Reading values.
+        target_points (int): Number of points to keep.
+
+    Returns:
+        list: The kept readings as {"value", "timestamp"} dictionaries.
+    """
+    timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+    values = np.asarray(values, dtype=np.float64)
+    kept = lttb(timestamps.astype(np.int64), values, target_points)
+    return [
+        {"value": float(value), "timestamp": timestamp}
+        for timestamp, value in zip(timestamps[kept].astype(object), values[kept])
+    ]
+
+
+def step_resample(timestamps, values, interval, start=None, end=None, max_hold=None):
+    """
+    Resamples a sparse (deadbanded) series onto a regular grid.
+
+    Each grid point takes the last stored value at or before it, which is what
+    the sensor reported while its readings stayed inside the deadband.
+
+    Args:
+        timestamps (np.ndarray): datetime64 reading timestamps in increasing order.
+        values (np.ndarray): Reading values.
+        interval (float): Seconds between grid points.
+        start (np.datetime64): First grid point (default: first reading).
+        end (np.datetime64): Last possible grid point (default: last reading).
+        max_hold (float): Seconds a value is held at most; later grid points are NaN (outage).
+
+    Returns:
+        tuple: (datetime64 grid timestamps, float64 values).
+    """
+    timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+    values = np.asarray(values, dtype=np.float64)
+    step = np.timedelta64(int(interval * 1_000_000), "us")
+    if len(timestamps) == 0:
+        return np.empty(0, "datetime64[us]"), np.empty(0, np.float64)
+    start = timestamps[0] if start is None else np.datetime64(start, "us")
+    end = timestamps[-1] if end is None else np.datetime64(end, "us")
+    grid = np.arange(start, end + np.timedelta64(1, "us"), step)
+
+    held = np.searchsorted(timestamps, grid, "right") - 1  # last reading at or before each grid point
+    valid = held >= 0
+    if max_hold is not None:
+        valid &= grid - timestamps[np.maximum(held, 0)] <= np.timedelta64(int(max_hold * 1_000_000), "us")
+    return grid, np.where(valid, values[np.maximum(held, 0)], np.nan)
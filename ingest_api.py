@@ -0,0 +1,111 @@
+# Author: Victor Vu and Jordan Morris
+# File: ingest_api.py
+# Description: Batch HTTP ingest endpoint so devices can send readings without database credentials
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import hmac
+import json
+import math
+import os
+import zlib
+from fastapi import HTTPException, Request
+from nicegui import app
+from collect_database import TANK_ID, backend, latest_cache, run_in_db_executor
+from storage import DEFAULT_TANK_ID, Reading
+from storage.base import AGGREGATE_COLUMNS
+
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")  # shared secret of the devices (ingest is off when unset)
+INGEST_MAX_BYTES = 16 * 1024 * 1024  # largest decompressed request body
+INGEST_BATCH_SIZE = 2000  # readings per insert_readings transaction
+MAX_EPOCH = 253402300800  # year 10000, later device times cannot be stored
+
+
+def check_token(request):  # Devices send "Authorization: Bearer <INGEST_TOKEN>"
+    if not INGEST_TOKEN:
+        raise HTTPException(503, "Ingest is disabled (INGEST_TOKEN is not set)")
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied, INGEST_TOKEN):
+        raise HTTPException(401, "Invalid ingest token")
+
+
+def decompress(body, encoding):  # gzip or plain JSON, refusing bodies that inflate past the limit
+    if encoding in ("", "identity"):
+        data = body
+    elif encoding == "gzip":
+        try:
+            data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, INGEST_MAX_BYTES + 1)
+        except zlib.error as e:
+            raise HTTPException(400, f"Corrupt gzip body: {e}")
+    else:
+        raise HTTPException(415, f"Unsupported Content-Encoding: {encoding}")
+    if len(data) > INGEST_MAX_BYTES:
+        raise HTTPException(413, "Request body is too large")
+    return data
+
+
+def check_name(field, name, optional=True):  # Names are VARCHAR(64) columns
+    if name is None and optional:
+        return None
+    if not isinstance(name, str) or not 0 < len(name) <= 64:
+        raise ValueError(f"bad {field}: {name!r}")
+    return name
+
+
+def check_number(field, number):  # Finite float, numeric strings included
+    if isinstance(number, bool) or not math.isfinite(float(number)):
+        raise ValueError(f"bad {field}: {number!r}")
+    return float(number)
+
+
+def check_time(recorded_at):  # Epoch seconds that local_timestamp() can convert
+    recorded_at = check_number("recorded_at", recorded_at)
+    if not 0 <= recorded_at < MAX_EPOCH:
+        raise ValueError(f"bad recorded_at: {recorded_at!r}")
+    return recorded_at
+
+
+def parse_readings(payload):  # {"tank_id", "device_id", "readings": [[sensor_type, value, recorded_at, ...]]}
+    tank_id = check_name("tank_id", payload.get("tank_id"))
+    device_id = check_name("device_id", payload.get("device_id"))
+    readings, rejected = [], []  # valid readings, and {"index", "error"} of the refused ones
+    for index, row in enumerate(payload.get("readings", [])):
+        try:
+            reading = Reading(*row)  # same field order as the device buffer
+            readings.append(
+                reading._replace(
+                    sensor_type=check_name("sensor_type", reading.sensor_type, optional=False),
+                    value=check_number(f"value of {reading.sensor_type}", reading.value),
+                    recorded_at=None if reading.recorded_at is None else check_time(reading.recorded_at),
+                    **{  # burst aggregates are optional
+                        field: check_number(field, getattr(reading, field))
+                        for field in AGGREGATE_COLUMNS
+                        if getattr(reading, field) is not None
+                    },
+                    tank_id=check_name("tank_id", reading.tank_id) or tank_id,
+                    device_id=check_name("device_id", reading.device_id) or device_id,
+                )
+            )
+        except (ValueError, TypeError) as e:  # one bad reading does not hold back the rest of the batch
+            rejected.append({"index": index, "error": str(e)})
+    return readings, rejected
+
+
+@app.get("/api/ingest")  # Health check used by devices before they flush
+def ingest_status():
+    return {"status": "ok"}
+
+
+@app.post("/api/ingest")  # Store a batch of readings from one device
+async def ingest(request: Request):
+    check_token(request)
+    body = decompress(await request.body(), request.headers.get("content-encoding", "").lower())
+    try:
+        readings, rejected = parse_readings(json.loads(body))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(400, f"Invalid readings: {e}")
+    for i in range(0, len(readings), INGEST_BATCH_SIZE):  # bulk inserts off the event loop
+        await run_in_db_executor(backend.insert_readings, readings[i:i + INGEST_BATCH_SIZE])
+
+    if any((reading.tank_id or DEFAULT_TANK_ID) == TANK_ID for reading in readings):
+        latest_cache.invalidate()  # this app's tank changed (the range cache finds new rows by id)
+    return {"stored": len(readings), "rejected": rejected}  # the device sets the rejected ones aside
@@ -3,10 +3,11 @@
 # Description: Main system file that connects to the MySQL database for sensor data.
 # Copyright (C) 2025 Victor V. Vu and Jordan Morris
 # License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
-from nicegui import ui
+from nicegui import app, ui
 import os
 import json
-from collect_database import create_connection, get_latest_data, env_reuse
+from collect_database import latest_cache, backend, env_reuse
+from storage import query_metrics
 from web_functions import inject_style, eco_header, eco_footer, inject_lottie
 from pages.contacts import contacts_page
 from pages.graphs import graphs_page
@@ -17,9 +18,9 @@ from pages.reminders import reminders_page
 from pages.predictions import predictions_page
 from pages.recommend import recommend_page
 from firebase import notifications_page
+import ingest_api  # registers /api/ingest on the app
 
 # Initialize global variables
-connection = create_connection()  # create a database connection
 graph_container = None  # container for graphs
 labels = {}  # sensor labels
 sensor_units = {  # sensor_type: unit
@@ -29,6 +30,14 @@ sensor_units = {  # sensor_type: unit
 }
 
 generate_default_settings()  # Ensure default settings file exists
+app.on_startup(latest_cache.start)  # one background task refreshes latest readings for all clients
+app.on_shutdown(backend.close)  # close idle database connections on exit
+
+
+@app.get("/metrics")  # Per-query latency histograms, rows and bytes (behind the login middleware)
+def metrics():
+    return {"slow_query_ms": query_metrics.slow_query_ms, "queries": query_metrics.snapshot()}
+
 
 # Function to read reminders from reminders.json
 def read_reminders():
@@ -140,8 +149,8 @@ def home_page():  # Home page function
     ui.timer(290, lambda: update_ui(labels))  # update ui every 290s
 
 
-def update_ui(labels):  # Update sensor labels with the latest data
-    data = get_latest_data()
+async def update_ui(labels):  # Update sensor labels with the latest data
+    data = await latest_cache.get_async()  # shared cache, at most one query per sensor interval
     if data:  # Update labels if data is available
         for (
             sensor_type,
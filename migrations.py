@@ -0,0 +1,33 @@
+# Author: Victor Vu and Jordan Morris
+# File: migrations.py
+# Description: Versioned schema migrations for the sensor database and query plan checks
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+# The migrations themselves live with each backend (storage/mysql_backend.py, storage/sqlite_backend.py)
+import sys
+from collect_database import backend
+from storage import DEFAULT_TANK_ID
+
+
+def migrate():  # Apply every pending migration in order
+    backend.migrate()
+
+
+def status():  # Print which migrations are applied
+    backend.status()
+
+
+def explain(days=30, tank_id=DEFAULT_TANK_ID):  # Print query plans and timings for the collect_database queries
+    backend.explain(days, tank_id)
+
+
+if __name__ == "__main__":  # python migrations.py migrate | status | explain [days] [tank_id]
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        migrate()
+    elif command == "status":
+        status()
+    elif command == "explain":
+        explain(int(sys.argv[2]) if len(sys.argv) > 2 else 30, sys.argv[3] if len(sys.argv) > 3 else DEFAULT_TANK_ID)
+    else:
+        print("Usage: python migrations.py migrate | status | explain [days] [tank_id]")
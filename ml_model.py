@@ -1,104 +1,341 @@
 # File: ml_model.py
 # Description: Machine learning model for predicting sensor values
 
+import multiprocessing
+import os
+import sys
+import threading
 import numpy as np
 import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
-from collect_database import get_all_data
+from collect_database import SENSOR_INTERVAL, TANK_ID, backend, get_extent, get_step_data_arrays
+from model_registry import registry
+from online_model import OnlineAR, update_model
 
 # Constants
 WINDOW_SIZE = 50  # Number of past values to use for prediction
 TEST_SIZE = 0.1  # Proportion of data to use for testing
 RANDOM_STATE = 42  # Random state for reproducibility
 N_ESTIMATORS = 20  # Number of estimators for the random forest model
+MODEL_TYPE = os.getenv("PREDICTION_MODEL", "forest")  # "online" updates an RLS model per reading instead
+# Processes (and forest threads) used for training, one core is left for the web server by default
+TRAINING_WORKERS = int(os.getenv("TRAINING_WORKERS", str(max(1, (os.cpu_count() or 1) - 1))))
+SENSOR_TYPES = ['turbidity', 'total dissolved solids', 'temperature']
+ROLLING_STATS = False  # Also feed the mean, std, min and max of each window to the model
+FEATURES = {  # Saved with each model, changing any of these retrains it
+    'window_size': WINDOW_SIZE,
+    'lag_order': 'oldest_first',
+    'rolling_stats': ROLLING_STATS,
+    'test_size': TEST_SIZE,
+    'random_state': RANDOM_STATE,
+    'n_estimators': N_ESTIMATORS,
+    'interval': SENSOR_INTERVAL,
+}
+
+# Lag features of the values before each target, built as views by lag_windows
+LagDataset = namedtuple('LagDataset', ['timestamps', 'X', 'y', 'window'])
 
 # TODO:
 # 1. Implement partial fit for random forest tree for improving model
-# 2. Other incremental learning practices
+#    (PREDICTION_MODEL=online already learns incrementally, see online_model.py)
 
 
-def prepare_data(sensor_type: str) -> tuple:
+def prepare_data(sensor_type: str, data: dict = None) -> tuple:
     """
     Prepares dataset with a larger window of past values.
 
     Args:
         sensor_type (str): Type of sensor data to prepare.
+        data (dict): Snapshot from load_history, fetched here if not given.
 
     Returns:
         tuple: X_train, X_test, y_train, y_test, latest_data
     """
-    # Load all data
-    data = get_all_data()
-
-    # Check if sensor type has sufficient data
-    if not is_sufficient_data(data, sensor_type):
-        print(f"Warning: Not enough data for {sensor_type}.")
+    dataset = load_dataset(sensor_type, data)
+    if dataset is None:
         return None, None, None, None, None
 
-    # Create a DataFrame from the sensor data
-    df = create_dataframe(data, sensor_type)
-
-    # Generate lag features using all available past readings
-    df = add_lag_features(df)
-
     # Split data into training and testing sets
-    X_train, X_test, y_train, y_test = split_data(df)
+    X_train, X_test, y_train, y_test = split_data(dataset)
 
     # Get the most recent sample for future prediction
-    latest_data = get_latest_data(df)
+    latest_data = get_latest_data(dataset)
 
     return X_train, X_test, y_train, y_test, latest_data
 
 
+def load_history(tank_id: str = TANK_ID) -> dict:
+    """
+    Loads every sensor's history once, to be shared by all sensors of a prediction run.
+
+    Args:
+        tank_id (str): Tank to load.
+
+    Returns:
+        dict: {sensor_type: (timestamps, values)} arrays on a regular grid.
+    """
+    return get_step_data_arrays(tank_id=tank_id)  # deadband gaps hold the last value, so every lag is one interval
+
+
+def load_dataset(sensor_type: str, data: dict = None):
+    """
+    Loads a sensor's readings as lag features.
+
+    Args:
+        sensor_type (str): Type of sensor data to load.
+        data (dict): Snapshot from load_history, fetched here if not given.
+
+    Returns:
+        LagDataset: Features and targets, or None if there is not enough data.
+    """
+    if data is None:
+        data = load_history()
+
+    # Check if sensor type has sufficient data
+    if not is_sufficient_data(data, sensor_type):
+        print(f"Warning: Not enough data for {sensor_type}.")
+        return None
+
+    # Generate lag features using all available past readings
+    dataset = create_dataset(data, sensor_type)
+    if dataset is None:
+        print(f"Warning: Not enough complete windows for {sensor_type}.")
+    return dataset
+
+
 def is_sufficient_data(data, sensor_type):
-    return sensor_type in data and len(data[sensor_type]) >= 5
+    return sensor_type in data and len(data[sensor_type][1]) > WINDOW_SIZE
 
 
-def create_dataframe(data, sensor_type):
-    df = pd.DataFrame(data[sensor_type])
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df.sort_values(by='timestamp', inplace=True)
-    return df
+def lag_windows(values: np.ndarray, window_size: int = WINDOW_SIZE) -> tuple:
+    """
+    Builds the lag matrix as a strided view over the values, without copying them.
 
+    Args:
+        values (np.ndarray): Evenly spaced values, NaN where the sensor was down.
+        window_size (int): Number of past values per row.
 
-def add_lag_features(df):
-    for i in range(1, WINDOW_SIZE + 1):
-        df[f'lag_{i}'] = df['value'].shift(i)
-    df.dropna(inplace=True)
-    return df
+    Returns:
+        tuple: windows (n - window_size, window_size) view ordered oldest to newest,
+            targets (the value after each window) and a mask of rows without NaN.
+    """
+    windows = sliding_window_view(values[:-1], window_size)
+    targets = values[window_size:]
+    missing = np.concatenate(([0], np.cumsum(np.isnan(values))))  # NaN count before each index
+    complete = missing[window_size + 1:] - missing[:len(targets)] == 0  # window and target have no NaN
+    return windows, targets, complete
 
 
-def split_data(df):
-    X = df[[f'lag_{i}' for i in range(1, WINDOW_SIZE + 1)]].values
-    y = df['value'].values
-    return train_test_split(X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+def window_features(windows: np.ndarray, rolling_stats: bool = ROLLING_STATS) -> np.ndarray:
+    """
+    Turns lag windows into model inputs.
 
+    Args:
+        windows (np.ndarray): (n, WINDOW_SIZE) lag windows.
+        rolling_stats (bool): Append the mean, standard deviation, min and max of each window.
 
-def get_latest_data(df):
-    last_reading = df.iloc[-1]['value']
-    latest_X = df.iloc[-1][[f'lag_{i}' for i in range(
-        1, WINDOW_SIZE + 1)]].values.reshape(1, -1)
+    Returns:
+        np.ndarray: The windows themselves, or the windows followed by their rolling stats.
+    """
+    if not rolling_stats:
+        return windows
+    return np.hstack((
+        windows,
+        windows.mean(axis=1, keepdims=True),
+        windows.std(axis=1, keepdims=True),
+        windows.min(axis=1, keepdims=True),
+        windows.max(axis=1, keepdims=True),
+    ))
+
+
+def create_dataset(data, sensor_type):
+    timestamps, values = data[sensor_type]  # already ordered by timestamp, one interval apart
+    windows, targets, complete = lag_windows(np.asarray(values, dtype=np.float64))
+    if complete.sum() < 5:
+        return None
+    if not complete.all():  # outages: keep only complete rows (the only copy of the windows)
+        windows, targets = windows[complete], targets[complete]
+    last = np.flatnonzero(complete)[-1] + WINDOW_SIZE  # index of the newest complete target
+    return LagDataset(
+        timestamps=np.asarray(timestamps)[WINDOW_SIZE:][complete],
+        X=window_features(windows),
+        y=targets,
+        window=values[last - WINDOW_SIZE + 1:last + 1],  # input for the value after the newest sample
+    )
+
+
+def split_data(dataset):
+    return train_test_split(dataset.X, dataset.y, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+
+
+def get_latest_data(dataset):
+    last_reading = dataset.window[-1]
+    latest_X = window_features(dataset.window.reshape(1, -1))
     return latest_X, last_reading
 
 
-def train_model(X_train: np.ndarray, y_train: np.ndarray) -> RandomForestRegressor:
+def train_model(X_train: np.ndarray, y_train: np.ndarray, n_jobs: int = 1) -> RandomForestRegressor:
     """
     Trains a Random Forest Regressor model.
 
     Args:
         X_train (np.ndarray): Training input data.
         y_train (np.ndarray): Training target data.
+        n_jobs (int): Threads building trees in parallel.
 
     Returns:
         RandomForestRegressor: Trained model.
     """
     model = RandomForestRegressor(
-        n_estimators=N_ESTIMATORS, random_state=RANDOM_STATE)
+        n_estimators=N_ESTIMATORS, random_state=RANDOM_STATE, n_jobs=n_jobs)
     model.fit(X_train, y_train)
     return model
 
 
+def fit_model(dataset: LagDataset, n_jobs: int = 1) -> tuple:
+    """
+    Trains a model on a lag feature dataset and describes it for the registry.
+
+    Args:
+        dataset (LagDataset): Output of load_dataset.
+        n_jobs (int): Threads building trees in parallel.
+
+    Returns:
+        tuple: Trained model and its metadata (training window, high-water mark, rows, R²).
+    """
+    X_train, X_test, y_train, y_test = split_data(dataset)
+    model = train_model(X_train, y_train, n_jobs)
+    return model, {
+        'window_start': pd.Timestamp(dataset.timestamps[0]).isoformat(),
+        'high_water': pd.Timestamp(dataset.timestamps[-1]).isoformat(),
+        'rows': len(dataset.y),
+        'r2': calculate_accuracy(model, X_test, y_test),
+    }
+
+
+def fit_series(sensor_type: str, timestamps: np.ndarray, values: np.ndarray, n_jobs: int = 1) -> tuple:
+    """
+    Builds the features and trains a model in a training process (only the series is sent to it).
+
+    Args:
+        sensor_type (str): Sensor the model predicts.
+        timestamps (np.ndarray): Grid timestamps from load_history.
+        values (np.ndarray): Values at each timestamp.
+        n_jobs (int): Threads building trees in parallel.
+
+    Returns:
+        tuple: Trained model and its metadata.
+    """
+    return fit_model(create_dataset({sensor_type: (timestamps, values)}, sensor_type), n_jobs)
+
+
+_training_pool = None
+_training_pool_lock = threading.Lock()
+
+
+def get_training_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by every training run, started on first use.
+
+    Returns:
+        ProcessPoolExecutor: TRAINING_WORKERS worker processes.
+    """
+    global _training_pool
+    with _training_pool_lock:
+        if _training_pool is None:
+            # forkserver: workers never inherit the web server's threads or the locks they hold
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["ml_model"])
+            _training_pool = ProcessPoolExecutor(max_workers=TRAINING_WORKERS, mp_context=context)
+        return _training_pool
+
+
+def get_model(sensor_type: str, dataset: LagDataset, data: dict, tank_id: str = TANK_ID, n_jobs: int = 1) -> tuple:
+    """
+    Returns the shared model for a sensor, retraining it once RETRAIN_NEW_ROWS new samples exist.
+
+    Args:
+        sensor_type (str): Sensor the model predicts.
+        dataset (LagDataset): Current output of load_dataset.
+        data (dict): Snapshot from load_history, sent to the training process.
+        tank_id (str): Tank the data belongs to.
+        n_jobs (int): Threads the forest may use while training.
+
+    Returns:
+        tuple: Model and its metadata.
+    """
+    if MODEL_TYPE == "online":  # learns only the samples since its last update
+        _, last = get_extent(tank_id=tank_id)  # the grid holds the newest reading until now, learn only up to it
+        until = None if last is None else np.datetime64(last, "us")
+        model = update_model(tank_id, sensor_type, *data[sensor_type], until)
+        return model, model.metadata()
+    return registry.get_or_train(
+        tank_id,
+        sensor_type,
+        FEATURES,
+        lambda high_water: int((dataset.timestamps > np.datetime64(high_water)).sum()),
+        lambda: get_training_pool().submit(fit_series, sensor_type, *data[sensor_type], n_jobs).result(),
+    )
+
+
+def get_models(jobs: list) -> dict:
+    """
+    Gets many models at once, training the stale ones in parallel within TRAINING_WORKERS.
+
+    Args:
+        jobs (list): (tank_id, sensor_type, dataset, data) for each model.
+
+    Returns:
+        dict: {(tank_id, sensor_type): (model, metadata)}.
+    """
+    if not jobs:
+        return {}
+    n_jobs = max(1, TRAINING_WORKERS // len(jobs))  # few models: each forest gets several cores
+    # Threads only wait on the registry and the training processes, no more than can train at once
+    with ThreadPoolExecutor(max_workers=min(len(jobs), TRAINING_WORKERS), thread_name_prefix="train") as executor:
+        futures = {
+            (tank_id, sensor_type): executor.submit(get_model, sensor_type, dataset, data, tank_id, n_jobs)
+            for tank_id, sensor_type, dataset, data in jobs
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+def train_all(sensor_types: list = SENSOR_TYPES) -> None:
+    """
+    Brings the models of every tank up to date, e.g. from cron so users rarely wait for training.
+
+    Args:
+        sensor_types (list): Sensors to train for each tank.
+    """
+    for tank_id in backend.tanks():  # one tank's history in memory at a time
+        data = load_history(tank_id)
+        datasets = {sensor_type: load_dataset(sensor_type, data) for sensor_type in sensor_types}
+        jobs = [(tank_id, sensor_type, dataset, data) for sensor_type, dataset in datasets.items() if dataset is not None]
+        for (_, sensor_type), (_, metadata) in get_models(jobs).items():
+            rows = metadata.get('rows', metadata.get('updates'))
+            print(f"{tank_id} {sensor_type}: R² {metadata['r2']:.2f}, {rows} rows")
+
+
+def predict_next(model, window: np.ndarray) -> float:
+    """
+    Predicts the value after a window of the newest values.
+
+    Args:
+        model: Forest from get_model or an OnlineAR.
+        window (np.ndarray): Newest WINDOW_SIZE values, oldest first.
+
+    Returns:
+        float: Predicted next value.
+    """
+    if isinstance(model, OnlineAR):
+        return model.predict_window(window)
+    return model.predict(window_features(window.reshape(1, -1)))[0]
+
+
 def get_predictions(sensor_types, end_timestamp, interval_minutes=10) -> dict:
     """
     Returns the predictions and accuracy for each sensor type.
@@ -112,25 +349,28 @@ def get_predictions(sensor_types, end_timestamp, interval_minutes=10) -> dict:
         dict: Dictionary with sensor types as keys and lists of predictions, accuracy, and last reading as values.
     """
     predictions = {}
-    for sensor_type in sensor_types:
-        X_train, X_test, y_train, y_test, latest_data = prepare_data(
-            sensor_type)
-        if X_train is not None:
-            model = train_model(X_train, y_train)
-            latest_X, last_reading = latest_data
-            accuracy = calculate_accuracy(model, X_test, y_test)
+    data = load_history()  # one fetch, however many sensor types there are
+    datasets = {sensor_type: load_dataset(sensor_type, data) for sensor_type in sensor_types}
+    models = get_models(  # saved models unless enough new data arrived, stale ones retrain in parallel
+        [(TANK_ID, sensor_type, dataset, data) for sensor_type, dataset in datasets.items() if dataset is not None]
+    )
+    for sensor_type, dataset in datasets.items():
+        if dataset is not None:
+            model, metadata = models[TANK_ID, sensor_type]
+            _, last_reading = get_latest_data(dataset)
+            accuracy = metadata['r2']
 
             # Generate multiple predictions
             predicted_values = []
             predicted_timestamps = []
-            current_timestamp = pd.to_datetime(
-                get_all_data()[sensor_type][-1]['timestamp'])
+            window = dataset.window.copy()  # newest WINDOW_SIZE values, oldest first
+            current_timestamp = pd.Timestamp(dataset.timestamps[-1])  # last sample the forecast starts from
             while current_timestamp < end_timestamp:
-                next_prediction = model.predict(latest_X)[0]
+                next_prediction = predict_next(model, window)
                 predicted_values.append(next_prediction)
                 predicted_timestamps.append(current_timestamp)
-                latest_X = np.roll(latest_X, -1)  # Shift the input values
-                latest_X[-1] = next_prediction  # Update the last input value
+                window = np.roll(window, -1)  # Shift the input values
+                window[-1] = next_prediction  # Update the last input value
                 current_timestamp += pd.Timedelta(minutes=interval_minutes)
 
             predictions[sensor_type] = {
@@ -158,18 +398,19 @@ def calculate_accuracy(model: RandomForestRegressor, X_test: np.ndarray, y_test:
 
 
 def main() -> None:
-    sensor_types = ['turbidity', 'total dissolved solids', 'temperature']
+    sensor_types = SENSOR_TYPES
+    data = load_history()
 
     for sensor_type in sensor_types:
         print(f"\nTraining model for {sensor_type}...")
 
         X_train, X_test, y_train, y_test, latest_data = prepare_data(
-            sensor_type)
+            sensor_type, data)
         if X_train is None:
             print(f"Skipping {sensor_type} due to insufficient data.")
             continue
 
-        model = train_model(X_train, y_train)
+        model = train_model(X_train, y_train, TRAINING_WORKERS)
         latest_X, last_reading = latest_data
         next_prediction = model.predict(latest_X)[0]
         expected_change = next_prediction - last_reading
@@ -184,5 +425,8 @@ def main() -> None:
         print("----------------------------")
 
 
-if __name__ == "__main__":
-    main()
+if __name__ == "__main__":  # python ml_model.py [train-all]
+    if len(sys.argv) > 1 and sys.argv[1] == "train-all":
+        train_all()
+    else:
+        main()
@@ -0,0 +1,104 @@
+# Author: Victor Vu and Jordan Morris
+# File: model_registry.py
+# Description: Stores trained prediction models on disk so they are shared and only retrained on new data
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import json
+import os
+import re
+import threading
+import time
+import joblib
+import sklearn
+
+MODEL_DIR = os.getenv("MODEL_DIR", "data/models")  # one .joblib file (model and metadata) per sensor, plus a readable .json copy
+RETRAIN_NEW_ROWS = int(os.getenv("RETRAIN_NEW_ROWS", "12"))  # new samples (1 hour at 5 minutes) before retraining
+
+
+class ModelRegistry:  # Trained models keyed by (tank_id, sensor_type), reused until enough new data arrives
+    def __init__(self, directory=MODEL_DIR, retrain_rows=RETRAIN_NEW_ROWS):
+        self.directory = directory
+        self.retrain_rows = retrain_rows
+        self._loaded = {}  # path -> (mtime, model, metadata), so a click does not re-read the file
+        self._locks = {}  # path -> lock, one training per model even with many users waiting
+        self._locks_lock = threading.Lock()
+
+    def path(self, tank_id, sensor_type, suffix):  # e.g. data/models/default/total_dissolved_solids.joblib
+        name = re.sub(r"[^A-Za-z0-9]+", "_", sensor_type).strip("_")
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_-]+", "_", tank_id), name + suffix)
+
+    def load(self, tank_id, sensor_type):  # (model, metadata), or (None, None) if nothing was saved yet
+        path = self.path(tank_id, sensor_type, ".joblib")
+        try:
+            mtime = os.path.getmtime(path)
+            cached = self._loaded.get(path)
+            if cached is None or cached[0] != mtime:  # saved by another process since we read it
+                saved = joblib.load(path)  # model and metadata from the same save, never mixed
+                cached = (mtime, saved["model"], saved["metadata"])
+                self._loaded[path] = cached
+        except FileNotFoundError:  # not trained yet
+            return None, None
+        except Exception as e:  # unreadable (e.g. pickled by another scikit-learn or an older layout), train a new one
+            print(f"Error loading model {path}: {e}")
+            return None, None
+        return cached[1], cached[2]
+
+    def save(self, tank_id, sensor_type, model, metadata):  # Model and metadata in one file, replaced atomically
+        model_path = self.path(tank_id, sensor_type, ".joblib")
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        for path, write in (
+            (model_path, lambda f: joblib.dump({"model": model, "metadata": metadata}, f)),
+            (self.path(tank_id, sensor_type, ".json"), lambda f: f.write(json.dumps(metadata, indent=2).encode())),
+        ):  # the .json is a readable copy only, load never uses it
+            partial = f"{path}.{os.getpid()}.partial"  # readers never see a half-written file, writers never share one
+            with open(partial, "wb") as f:
+                write(f)
+            os.replace(partial, path)
+        self._loaded[model_path] = (os.path.getmtime(model_path), model, metadata)
+
+    def is_current(self, metadata, features, new_rows):  # Same feature setup and not enough new data yet
+        return (
+            metadata is not None
+            and metadata.get("features") == features
+            and metadata.get("sklearn_version") == sklearn.__version__  # pickles are tied to the version
+            and new_rows < self.retrain_rows
+        )
+
+    def _lock(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def get_or_train(self, tank_id, sensor_type, features, count_new_rows, train):
+        """
+        Returns a saved model, training and saving a new one when it is missing or stale.
+
+        Args:
+            tank_id (str): Tank the data belongs to.
+            sensor_type (str): Sensor the model predicts.
+            features (dict): Feature and model settings, a change forces retraining.
+            count_new_rows (callable): count_new_rows(high_water) -> samples newer than a saved model's data.
+            train (callable): train() -> (model, metadata) with "high_water", "window_start" and "r2".
+
+        Returns:
+            tuple: (model, metadata).
+        """
+        with self._lock(self.path(tank_id, sensor_type, ".joblib")):  # later callers reuse the first one's model
+            model, metadata = self.load(tank_id, sensor_type)
+            if metadata is not None and self.is_current(metadata, features, count_new_rows(metadata["high_water"])):
+                return model, metadata
+            started = time.perf_counter()
+            model, metadata = train()
+            metadata = {
+                **metadata,
+                "tank_id": tank_id,
+                "sensor_type": sensor_type,
+                "features": features,
+                "sklearn_version": sklearn.__version__,
+                "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "training_seconds": round(time.perf_counter() - started, 3),
+            }
+            self.save(tank_id, sensor_type, model, metadata)
+            return model, metadata
+
+
+registry = ModelRegistry()  # shared by every prediction request in this process
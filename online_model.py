@@ -0,0 +1,138 @@
+# Author: Victor Vu and Jordan Morris
+# File: online_model.py
+# Description: Autoregressive forecaster learned online with recursive least squares, saved between restarts
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import json
+import os
+import threading
+import numpy as np
+from model_registry import registry
+
+ONLINE_WINDOW = 12  # past values per prediction (1 hour at 5 minutes)
+FORGETTING = float(os.getenv("ONLINE_FORGETTING", "0.999"))  # weight kept by older samples per update (1 = none forgotten)
+P_INIT = 1000.0  # initial covariance, large so the first readings set the weights
+P_MAX_TRACE = 1e6  # bounds covariance growth while the deadband holds a value (no new information)
+
+
+class OnlineAR:  # AR model on changes from the newest value, one RLS update per new sample
+    def __init__(self, window_size=ONLINE_WINDOW, forgetting=FORGETTING):
+        self.window_size = window_size
+        self.forgetting = forgetting
+        self.weights = np.zeros(window_size + 1)  # one per lag plus a drift term
+        self.P = np.eye(window_size + 1) * P_INIT  # inverse correlation of the inputs
+        self.high_water = None  # timestamp of the newest sample learned
+        self.updates = 0
+        self.sse = 0.0  # forgotten sums of squared errors of predictions made before each update
+        self.sst = 0.0  # and of squared deviations from the running mean, for an online R²
+        self.mean = None
+
+    def inputs(self, window):  # (x, anchor): lags relative to the newest value, so a flat tank is all zeros
+        window = np.asarray(window[-self.window_size:], dtype=np.float64)
+        anchor = window[-1]
+        return np.append(window - anchor, 1.0), anchor
+
+    def predict_window(self, window):  # Next value after a window of the newest values, oldest first
+        x, anchor = self.inputs(window)
+        return float(anchor + self.weights @ x)
+
+    def learn(self, window, target):  # One recursive least squares step, O(window_size²)
+        x, anchor = self.inputs(window)
+        error = target - anchor - self.weights @ x  # prediction error before learning this sample
+        Px = self.P @ x
+        gain = Px / (self.forgetting + x @ Px)
+        self.weights += gain * error
+        self.P = (self.P - np.outer(gain, Px)) / self.forgetting
+        trace = np.trace(self.P)
+        if trace > P_MAX_TRACE:
+            self.P *= P_MAX_TRACE / trace
+
+        if self.mean is None:
+            self.mean = target
+        self.sse = self.forgetting * self.sse + error * error
+        self.sst = self.forgetting * self.sst + (target - self.mean) ** 2
+        self.mean += (1 - self.forgetting) * (target - self.mean)
+        self.updates += 1
+
+    def update(self, timestamps, values, until=None):
+        """
+        Learns every sample newer than the high-water mark.
+
+        Args:
+            timestamps (np.ndarray): datetime64 timestamps, evenly spaced.
+            values (np.ndarray): Values at each timestamp, NaN where the sensor was down.
+            until (np.datetime64): Newest stored reading; later samples only hold it and are left
+                for a later update, when a buffering device may have sent the real ones (default: learn all).
+
+        Returns:
+            int: Number of samples learned (only these are touched, not the whole history).
+        """
+        start = 0 if self.high_water is None else int(np.searchsorted(timestamps, self.high_water, "right"))
+        stop = len(values) if until is None else int(np.searchsorted(timestamps, until, "right"))
+        learned = 0
+        for i in range(max(start, self.window_size), stop):
+            window = values[i - self.window_size:i]
+            if np.isnan(values[i]) or np.isnan(window).any():  # outage, nothing to learn from
+                continue
+            self.learn(window, values[i])
+            self.high_water = timestamps[i]
+            learned += 1
+        return learned
+
+    @property
+    def r2(self):  # R² of the one-step predictions made just before learning each sample
+        return 1.0 - self.sse / self.sst if self.sst > 0 else 0.0
+
+    def metadata(self):
+        return {
+            "window_size": self.window_size,
+            "forgetting": self.forgetting,
+            "high_water": None if self.high_water is None else str(self.high_water),
+            "updates": self.updates,
+            "sse": self.sse,
+            "sst": self.sst,
+            "mean": self.mean,
+            "r2": self.r2,
+        }
+
+    def save(self, path):  # Weights, covariance and metadata in one .npz, replaced atomically
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.partial"  # the web server and train-all may save the same model at once
+        with open(partial, "wb") as f:
+            np.savez(f, weights=self.weights, P=self.P, metadata=json.dumps(self.metadata()))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path, window_size=ONLINE_WINDOW, forgetting=FORGETTING):  # Saved state, or a new model
+        model = cls(window_size, forgetting)
+        try:
+            with np.load(path) as state:
+                metadata = json.loads(str(state["metadata"]))
+                if (metadata["window_size"], metadata["forgetting"]) != (window_size, forgetting):
+                    return model  # settings changed, learn from scratch
+                model.weights, model.P = state["weights"], state["P"]
+        except FileNotFoundError:
+            return model
+        except Exception as e:  # corrupt file, learn from scratch
+            print(f"Error loading online model {path}: {e}")
+            return model
+        if metadata["high_water"] is not None:
+            model.high_water = np.datetime64(metadata["high_water"], "us")
+        model.updates, model.mean = metadata["updates"], metadata["mean"]
+        model.sse, model.sst = metadata["sse"], metadata["sst"]
+        return model
+
+
+_models = {}  # path -> OnlineAR, loaded once per process
+_lock = threading.Lock()  # one update at a time, the models are small
+
+
+def update_model(tank_id, sensor_type, timestamps, values, until=None):  # Load, learn the new samples and save
+    path = registry.path(tank_id, sensor_type, ".online.npz")  # next to the saved forests
+    with _lock:
+        model = _models.get(path)
+        if model is None:
+            model = _models[path] = OnlineAR.load(path)
+        if model.update(timestamps, values, until):
+            model.save(path)
+        return model
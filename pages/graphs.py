@@ -3,14 +3,14 @@
 from nicegui import ui
 from datetime import datetime
 from web_functions import inject_style, eco_header, eco_footer
-from collect_database import get_all_data
+from collect_database import get_downsampled_data_async
 
 
-def generate_graphs(graph_container, data=None):  # Generate graphs for sensor data
-    graph_container.clear()  # reset the graph container
-
+async def generate_graphs(graph_container, data=None):  # Generate graphs for sensor data
     if data is None:  # Fetch all data if none is provided
-        data = get_all_data()
+        data = await get_downsampled_data_async()  # bounded number of points per sensor
+
+    graph_container.clear()  # reset the graph container
 
     if data:  # Generate graphs if data is available
         desired_order = ["total dissolved solids", "turbidity", "temperature"]
@@ -117,19 +117,19 @@ def graphs_page(graph_container):  # Graphs page for the web interface
             # on value change, update the date input
             date_picker.on("update:model-value", update_date_input)
 
+            async def filter_data():  # Graph the selected range without blocking the page
+                date_dialog.close()  # close the dialog
+                data = (
+                    await get_downsampled_data_async(*date_input.value.split(" - "))
+                    if date_input.value
+                    else await get_downsampled_data_async()
+                )
+                await generate_graphs(graph_container, data)
+
             with ui.row().classes("mt-0 my-2"):  # Create a row for the filter button
-                ui.button(
-                    "Filter Data",
-                    on_click=lambda: (
-                        generate_graphs(
-                            graph_container,
-                            get_all_data(*date_input.value.split(" - "))
-                            if date_input.value
-                            else get_all_data(),
-                        ),
-                        date_dialog.close(),  # close the dialog
-                    ),
-                ).classes("bg-teal-500 text-white mt-0 my-2")
+                ui.button("Filter Data", on_click=filter_data).classes(
+                    "bg-teal-500 text-white mt-0 my-2"
+                )
 
     with ui.row().classes(
         "justify-center w-full mt-0 my-2"
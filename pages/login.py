@@ -10,7 +10,7 @@ from web_functions import inject_style
 from pages.register import register_page, passwords
 
 # unrestricted routes without authentication
-unrestricted_routes = {"/login", "/register"}
+unrestricted_routes = {"/login", "/register", "/api/ingest"}  # ingest checks its own device token
 
 
 class AuthMiddleware(BaseHTTPMiddleware):  # Authentication middleware
@@ -3,7 +3,7 @@
 import json
 from nicegui import ui
 from web_functions import eco_header, eco_footer, inject_style
-from collect_database import get_latest_data 
+from collect_database import latest_cache
 
 # Define global dictionaries for thresholds
 tds_references = {}
@@ -72,13 +72,13 @@ def recommend_page():  # Function to display the recommend page
                 "text-white text-base mt-4"
             )
 
-    def on_button_click(): # Function to handle button click
+    async def on_button_click(): # Function to handle button click
         tds_label.set_text("Fetching data...")
         turbidity_label.set_text("Fetching data...")
         temperature_label.set_text("Fetching data...")
 
         # Fetch the latest sensor data
-        data = get_latest_data()
+        data = await latest_cache.get_async()  # shared cache refreshed once per sensor interval
         if data:
             # TDS Recommendations
             tds_value = data["total dissolved solids"]["value"]
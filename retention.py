@@ -0,0 +1,58 @@
+# Author: Victor Vu and Jordan Morris
+# File: retention.py
+# Description: Keeps recent raw readings in the database and moves older months to Parquet files
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+# Rollup tables keep every month, so statistics and long-range graphs still cover archived data
+import os
+import sys
+from datetime import datetime, timedelta
+from collect_database import archive, backend
+from migrations import migrate
+from storage.base import month_start, next_month
+
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "3"))  # whole months of raw rows kept hot
+PARTITIONS_AHEAD = 2  # empty monthly partitions created in advance for new readings
+
+
+def cutoff(retention_months=RETENTION_MONTHS):  # Months before this are archived
+    month = month_start(datetime.now())
+    for _ in range(retention_months):
+        month = month_start(month - timedelta(days=1))  # step back one month
+    return month
+
+
+def partition():  # Split sensor_data into monthly partitions up to a few months ahead
+    first, _ = backend.extent()
+    last = month_start(datetime.now())
+    for _ in range(PARTITIONS_AHEAD):
+        last = next_month(last)
+    backend.ensure_partitions(month_start(first or datetime.now()), last)
+
+
+def month_rows(month):  # Chunks of (tank_id, sensor_type, value, timestamp) rows for one month
+    end = next_month(month) - timedelta(seconds=1)
+    for tank_id in backend.tanks():
+        for rows in backend.iter_range(month, end, tank_id=tank_id):
+            yield [(tank_id, *row) for row in rows]
+
+
+def archive_months(retention_months=RETENTION_MONTHS):  # Move months older than the cutoff to Parquet
+    end = cutoff(retention_months)
+    first, _ = backend.extent(None, end - timedelta(seconds=1))
+    if first is None:
+        print("Nothing to archive")
+        return
+    month = month_start(first)
+    while month < end:  # oldest first, so a dropped partition never holds unarchived rows
+        rows = archive.write_month(month, month_rows(month))
+        if rows:
+            backend.drop_month(month)  # only after the Parquet file is in place
+            print(f"{month:%Y-%m}: {rows} rows archived to {archive.path(month)}")
+        month = next_month(month)
+
+
+if __name__ == "__main__":  # python retention.py [retention_months]
+    migrate()  # partitioning is added by migration 5
+    partition()
+    archive_months(int(sys.argv[1]) if len(sys.argv) > 1 else RETENTION_MONTHS)
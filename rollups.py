@@ -0,0 +1,17 @@
+# Author: Victor Vu and Jordan Morris
+# File: rollups.py
+# Description: Backfill command for the hourly/daily rollup tables of sensor data
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import sys
+from collect_database import backend
+from migrations import migrate
+
+
+def backfill(start_date=None, end_date=None):  # Recompute rollups from raw sensor_data (use midnight bounds)
+    backend.backfill_rollups(start_date, end_date)
+
+
+if __name__ == "__main__":  # python rollups.py [start_date [end_date]]
+    migrate()  # rollup tables are created by migration 3
+    backfill(*sys.argv[1:3])
@@ -0,0 +1,91 @@
+# Author: Victor Vu
+# File: acquisition.py
+# Description: Single daemon that samples every sensor and stores each cycle with one multi-row insert
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tds_sensor
+import temp_sensor
+import turb_sensor
+from analog import read_voltage
+from connect_timer import SENSOR_INTERVAL, Reading, buffer_readings, flush_readings
+from deadband import Deadband
+from oversample import BURST_SAMPLES, BurstSampler
+from scheduler import every
+
+SENSORS = {  # sensor_type: (open the device, read one raw sample, convert samples to values or None)
+    temp_sensor.SENSOR_TYPE: (temp_sensor.open_sensor, temp_sensor.read_temperature, None),  # ~750 ms per 1-Wire read
+    tds_sensor.SENSOR_TYPE: (tds_sensor.open_sensor, read_voltage, tds_sensor.tds_from_voltage),
+    turb_sensor.SENSOR_TYPE: (turb_sensor.open_sensor, read_voltage, turb_sensor.read_turbidity),
+}
+# Comma separated sensor types to sample (all of them by default)
+ENABLED_SENSORS = [name.strip() for name in os.getenv("SENSORS", ",".join(SENSORS)).split(",") if name.strip()]
+# Per-sensor seconds between reads, e.g. "temperature=60,turbidity=300" (others use SENSOR_INTERVAL)
+SENSOR_INTERVALS = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        item.split("=", 1) for item in os.getenv("SENSOR_INTERVALS", "").split(",") if "=" in item
+    )
+}
+FLUSH_DELAY = 5  # seconds after each tick before flushing, so reads due at that tick are batched together
+
+
+def open_sensors(sensor_types=ENABLED_SENSORS):  # {sensor_type: device}, the ADS1115 channels share one bus
+    devices = {}
+    for sensor_type in sensor_types:
+        open_device, _, _ = SENSORS[sensor_type]
+        devices[sensor_type] = open_device()
+    return devices
+
+
+def read_sensor(sensor_type, device, sampler=None):  # One Reading, or None if the read failed (blocking)
+    _, read, convert = SENSORS[sensor_type]
+    recorded_at = time.time()  # device time of the read
+    try:
+        if convert is None:  # already in its unit, read once
+            reading = Reading(sensor_type, read(device), recorded_at)
+        elif sampler is not None:  # burst of samples, stored as median plus aggregates
+            reading = sampler.read(sensor_type, lambda: read(device), convert, recorded_at)
+        else:
+            reading = Reading(sensor_type, float(convert(read(device))), recorded_at)
+    except Exception as e:
+        print(f"Error reading {sensor_type}: {e}")
+        return None
+    print(f"{sensor_type}: {reading.value:.2f}")
+    return reading
+
+
+async def run():  # Read every sensor on its own aligned interval and flush the buffer in batches
+    loop = asyncio.get_running_loop()
+    devices = open_sensors()
+    intervals = {sensor_type: SENSOR_INTERVALS.get(sensor_type, SENSOR_INTERVAL) for sensor_type in devices}
+    # One thread per sensor, so a slow 1-Wire read never delays the analog sensors
+    read_executor = ThreadPoolExecutor(max_workers=max(1, len(devices)), thread_name_prefix="sensor")
+    # The buffer file and database connection are used from a single thread
+    store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+    deadband = Deadband()  # unchanged readings are skipped until the next heartbeat
+
+    def sensor_job(sensor_type):
+        sampler = BurstSampler() if BURST_SAMPLES > 1 else None  # each sensor fills its own buffer
+
+        async def job(tick):
+            reading = await loop.run_in_executor(read_executor, read_sensor, sensor_type, devices[sensor_type], sampler)
+            if reading is not None and deadband.keep(reading):
+                await loop.run_in_executor(store_executor, buffer_readings, [reading])
+
+        return job
+
+    async def flush_job(tick):  # everything read since the last flush goes out in one multi-row insert
+        await loop.run_in_executor(store_executor, flush_readings)
+
+    await asyncio.gather(
+        *(every(intervals[sensor_type], sensor_job(sensor_type)) for sensor_type in devices),
+        every(min(intervals.values(), default=SENSOR_INTERVAL), flush_job, FLUSH_DELAY),
+    )
+
+
+if __name__ == "__main__":  # python sensors/acquisition.py
+    asyncio.run(run())
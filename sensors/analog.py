@@ -0,0 +1,29 @@
+# Author: Victor Vu
+# File: analog.py
+# Description: Shared I2C bus and ADS1115 converter for the analog (TDS and turbidity) sensors
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import threading
+
+ADS_DATA_RATE = 860  # samples per second, the ADS1115 maximum (bursts finish in well under a second)
+_ads = None  # one ADS1115 (and I2C bus) per process
+_bus_lock = threading.Lock()  # sensors read from different threads, one conversion at a time
+
+
+def open_ads():  # ADS1115 object that converts the analog signals to digital
+    global _ads
+    if _ads is None:
+        import board  # hardware libraries only load on the Pi (not with SENSOR_DRIVER=sim)
+        import busio
+        import adafruit_ads1x15.ads1115 as ADS
+
+        i2c = busio.I2C(  # I2C interface that reads from GPIO pins SCL and SDA
+            board.SCL, board.SDA
+        )
+        _ads = ADS.ADS1115(i2c, data_rate=ADS_DATA_RATE)
+    return _ads
+
+
+def read_voltage(channel):  # One raw sample from an analog input channel
+    with _bus_lock:
+        return channel.voltage
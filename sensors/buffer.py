@@ -0,0 +1,147 @@
+# Author: Victor Vu
+# File: buffer.py
+# Description: On-disk buffer that every reading is written to before it is flushed to the database
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import json
+import os
+import random
+import time
+from connect_timer import Reading
+
+FLUSH_BATCH_SIZE = 500  # readings per insert when draining a backlog
+RETRY_MIN = 5  # seconds to wait after the first failed flush
+RETRY_MAX = 300  # upper bound for the doubling wait while the database is unreachable
+
+
+class RejectedBatch(Exception):  # Raised by a sink that will never accept some or all readings of a batch
+    def __init__(self, message, indexes=None):
+        super().__init__(message)
+        self.indexes = indexes  # positions of the refused readings in the batch, None for all of them (HTTP 4xx)
+
+
+class ReadingBuffer:  # Append-only file of readings, plus the offset of the first unflushed one
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.rejected_path = path + ".rejected"  # batches the server refused, kept for inspection
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            with open(self.offset_path) as file:
+                self.offset = int(file.read() or 0)
+        except FileNotFoundError:
+            self.offset = 0
+        if self.offset > self.pending_end():  # crashed after emptying the drained file, before saving 0
+            self.offset = 0
+
+    def append(self, readings):  # Durably store readings (survives power loss once this returns)
+        if not readings:
+            return
+        lines = "".join(json.dumps(list(reading)) + "\n" for reading in readings)
+        with open(self.path, "a+b") as file:
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    lines = "\n" + lines  # end the line a crash cut short, it is skipped as corrupt
+            file.write(lines.encode())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def quarantine(self, readings):  # Keep refused readings aside so they no longer block the buffer
+        with open(self.rejected_path, "a") as file:
+            file.write("".join(json.dumps(list(reading)) + "\n" for reading in readings))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read_batch(self, max_readings=FLUSH_BATCH_SIZE):  # (oldest unflushed readings, offset after them)
+        readings, end = [], self.offset
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(self.offset)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break  # last line was cut short by a crash, it is not a reading
+                    end += len(line)
+                    try:
+                        readings.append(Reading(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        print(f"Skipping corrupt buffered reading: {line!r}")
+                    if len(readings) >= max_readings:
+                        break
+        except FileNotFoundError:
+            pass
+        return readings, end
+
+    def commit(self, end):  # Mark everything before `end` as stored in the database
+        if end >= self.pending_end():  # fully drained, start the file over
+            with open(self.path, "w") as file:
+                os.fsync(file.fileno())  # empty on disk before the offset of 0 is, see __init__
+            end = 0
+        self.save_offset(end)
+
+    def save_offset(self, end):
+        partial = self.offset_path + ".partial"
+        with open(partial, "w") as file:
+            file.write(str(end))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(partial, self.offset_path)  # never leaves a half-written offset behind
+        self.offset = end
+
+    def pending_end(self):  # Size of the buffer file
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def pending_bytes(self):
+        return max(0, self.pending_end() - self.offset)
+
+
+class BufferFlusher:  # Drains a ReadingBuffer in batches, backing off while the database is down
+    def __init__(self, buffer, connect, batch_size=FLUSH_BATCH_SIZE, retry_min=RETRY_MIN, retry_max=RETRY_MAX):
+        self.buffer = buffer
+        self.connect = connect  # () -> storage backend, or None if the database is unreachable
+        self.batch_size = batch_size
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.delay = 0  # current backoff, 0 while flushes succeed
+        self.next_attempt = 0.0  # time.monotonic() before which flush() does nothing
+
+    def flush(self):  # Store buffered readings, returns how many were stored (never raises)
+        if time.monotonic() < self.next_attempt:
+            return 0
+        flushed = 0
+        try:
+            connection = None
+            while True:
+                readings, end = self.buffer.read_batch(self.batch_size)
+                if not readings:
+                    if end > self.buffer.offset:  # only corrupt lines were read
+                        self.buffer.commit(end)
+                        continue
+                    break
+                if connection is None:
+                    connection = self.connect()
+                    if connection is None:
+                        raise ConnectionError("database is unreachable")
+                # A crash between this commit and the offset update replays the batch once
+                try:
+                    connection.insert_readings(readings)  # one executemany batch, device timestamps kept
+                    flushed += len(readings)
+                except RejectedBatch as e:  # retrying cannot help, the rest of the batch was stored
+                    refused = readings if e.indexes is None else [readings[i] for i in e.indexes]
+                    flushed += len(readings) - len(refused)
+                    print(f"Moved {len(refused)} rejected readings to {self.buffer.rejected_path}: {e}")
+                    self.buffer.quarantine(refused)
+                self.buffer.commit(end)
+            self.delay = 0
+        except Exception as e:
+            self.delay = min(max(self.delay * 2, self.retry_min), self.retry_max)
+            # Random jitter so devices that lost the same network do not retry in lockstep
+            self.next_attempt = time.monotonic() + self.delay * random.uniform(0.5, 1.0)
+            print(
+                f"Error flushing readings ({self.buffer.pending_bytes()} bytes buffered), "
+                f"retrying in {self.delay}s: {e}"
+            )
+        return flushed
@@ -1,49 +1,89 @@
 # Author: Victor Vu
 # File: connect_timer.py
-# Description: MySQL connection for all sensors and provide a central timer
+# Description: Database connection and reading buffer for all sensors, and a central timer
 # Copyright (C) 2025 Victor V. Vu and Jordan Morris
 # License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
-import pymysql
+import math
 import os
+import socket
+import sys
 import time
 from dotenv import load_dotenv
-from urllib.parse import urlparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root for storage
+from storage import get_backend, DEFAULT_TANK_ID, Reading  # Reading is re-exported for the sensor scripts
 
 load_dotenv()  # Load environment variables from .env
 
-# Parse database URL from .env file
+# Database URL from .env file (mysql://... or sqlite:///path/to/file.db)
 db_url = os.getenv("DATABASE_URL")
-parsed_url = urlparse(db_url)
-connection = None  # initialize connection
+connection = None  # initialize connection (storage backend)
+SENSOR_INTERVAL = 300  # seconds between readings (web app caches latest data for this long)
+SENSOR_DRIVER = os.getenv("SENSOR_DRIVER", "hardware")  # "sim" runs the sensors without a Raspberry Pi
+TANK_ID = os.getenv("TANK_ID", DEFAULT_TANK_ID)  # tank these sensors are in
+DEVICE_ID = os.getenv("DEVICE_ID", socket.gethostname())  # this Pi
+# Set INGEST_URL (and INGEST_TOKEN) to send readings to a central server instead of the database
+INGEST_URL = os.getenv("INGEST_URL")
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")
+# Readings wait here until they are in the database, one file per sensor process
+BUFFER_DIR = os.getenv("READING_BUFFER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "buffer"))
+flusher = None  # BufferFlusher, opened by the first store_readings()
 
 
-def create_connection():  # Establish MySQL connection
+def create_connection():  # Open the storage backend if it is not reachable yet
     global connection
-    try:  # If not open make new connection
-        if connection is None or not connection.open:
-            connection = pymysql.connect(
-                host=parsed_url.hostname,
-                user=parsed_url.username,
-                password=parsed_url.password,
-                database=parsed_url.path[1:],
-                port=parsed_url.port,
-                autocommit=True,  # enable autocommit to refresh data
-            )
-    except pymysql.MySQLError as e:  # Error handling
-        print(f"Error connecting to MySQL: {e}")
-        connection = None
+    if connection is None or not connection.ping():
+        if connection is not None:
+            connection.close()  # drop the broken connection before opening a new one
+        if INGEST_URL:  # no database credentials needed on the device
+            from http_sink import HttpSink
+
+            backend = HttpSink(INGEST_URL, INGEST_TOKEN, DEVICE_ID, TANK_ID)
+        else:
+            backend = get_backend(db_url, pool_size=1)  # one sensor process needs one connection
+        if backend.ping():
+            connection = backend
+        else:  # Error handling
+            print("Error connecting to the database")
+            connection = None
     return connection
 
 
-def reconnect():  # Reconnect if connection is lost
-    global connection
-    while connection is None or not connection.open:
-        print("Attempting to reconnect to MySQL...")
-        create_connection()
-        if connection is None or not connection.open:
-            time.sleep(5)  # wait 5 seconds before retrying
+def open_flusher():  # Buffer named after the running script (acquisition, tds_sensor, ...)
+    global flusher
+    if flusher is None:
+        from buffer import BufferFlusher, ReadingBuffer  # buffer.py imports Reading from here
+
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "sensors"
+        flusher = BufferFlusher(ReadingBuffer(os.path.join(BUFFER_DIR, f"{name}.buffer")), create_connection)
+    return flusher
+
+
+def buffer_readings(readings):  # Durably queue readings for the database (local disk only)
+    open_flusher().buffer.append(
+        [
+            reading._replace(tank_id=reading.tank_id or TANK_ID, device_id=reading.device_id or DEVICE_ID)
+            for reading in readings
+        ]
+    )
+
+
+def flush_readings():  # Send buffered readings to the database, returns how many were stored
+    return open_flusher().flush()  # backs off on its own while the database is unreachable
+
+
+def store_readings(readings):  # Write readings to the local buffer first, then flush what we can
+    buffer_readings(readings)
+    return flush_readings()
+
+
+def insert_reading(sensor_type, value):  # Store one reading taken now (device time)
+    store_readings([Reading(sensor_type, value, time.time())])
+
+
+def next_tick(after, interval, offset=0.0):  # First wall-clock multiple of interval (+offset) after `after`
+    return (math.floor((after - offset) / interval) + 1) * interval + offset
 
 
-def control_timer():  # Set timer to control the frequency
-    reconnect()  # Ensure connection is active
-    time.sleep(300)  # wait 300sec before reading again
+def control_timer(interval=SENSOR_INTERVAL):  # Wait for the next aligned tick (no drift from read/insert time)
+    time.sleep(max(0.0, next_tick(time.time(), interval) - time.time()))
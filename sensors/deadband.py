@@ -0,0 +1,46 @@
+# Author: Victor Vu
+# File: deadband.py
+# Description: Per-sensor deadband that only stores readings that moved, plus a periodic heartbeat row
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import os
+import tds_sensor
+import temp_sensor
+import turb_sensor
+
+DEFAULT_DEADBANDS = {  # sensor_type: smallest change worth storing, around each sensor's precision
+    temp_sensor.SENSOR_TYPE: 0.2,  # °F, stored as read (DS18B20 steps are 0.0625 °C = 0.1125 °F)
+    tds_sensor.SENSOR_TYPE: 2.0,  # ppm
+    turb_sensor.SENSOR_TYPE: 0.5,  # NTU
+}
+# Per-sensor overrides, e.g. "temperature=0.5,turbidity=0" (0 stores every reading)
+DEADBANDS = {
+    **DEFAULT_DEADBANDS,
+    **{
+        name.strip(): float(band)
+        for name, band in (item.split("=", 1) for item in os.getenv("DEADBANDS", "").split(",") if "=" in item)
+    },
+}
+# A reading is stored at least this often even if it never leaves the deadband (0 turns the deadband off)
+HEARTBEAT_MINUTES = float(os.getenv("HEARTBEAT_MINUTES", "60"))
+
+
+class Deadband:  # Remembers the last stored value per sensor and drops readings that stay within the band
+    def __init__(self, deadbands=DEADBANDS, heartbeat_minutes=HEARTBEAT_MINUTES):
+        self.deadbands = deadbands
+        self.heartbeat = heartbeat_minutes * 60  # seconds
+        self.stored = {}  # sensor_type -> (value, recorded_at) of the last reading kept
+
+    def keep(self, reading):  # True if the reading should be stored, remembering it as the new reference
+        band = self.deadbands.get(reading.sensor_type, 0.0)
+        last = self.stored.get(reading.sensor_type)
+        if (
+            self.heartbeat > 0
+            and band > 0
+            and last is not None
+            and abs(reading.value - last[0]) <= band
+            and reading.recorded_at - last[1] < self.heartbeat
+        ):
+            return False  # queries hold the last stored value over the gap
+        self.stored[reading.sensor_type] = (reading.value, reading.recorded_at)
+        return True
@@ -0,0 +1,51 @@
+# Author: Victor Vu
+# File: http_sink.py
+# Description: Sends buffered readings to a central server's /api/ingest instead of the database
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import gzip
+import json
+import requests
+from buffer import RejectedBatch
+
+HTTP_TIMEOUT = 15  # seconds per request
+RETRY_STATUSES = {408, 429}  # client errors that are worth retrying (timeout, rate limit)
+
+
+class HttpSink:  # Same insert_readings/ping/close calls as a storage backend, over HTTPS
+    def __init__(self, url, token, device_id=None, tank_id=None):
+        self.url = url  # e.g. https://server.example/api/ingest
+        self.tank_id = tank_id
+        self.device_id = device_id
+        self.session = requests.Session()  # keeps the connection open between flushes
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def ping(self):  # True if the server is reachable
+        try:
+            return self.session.get(self.url, timeout=HTTP_TIMEOUT).ok
+        except requests.RequestException:
+            return False
+
+    def insert_readings(self, readings):  # One gzip-compressed POST per batch
+        payload = {
+            "tank_id": self.tank_id,
+            "device_id": self.device_id,
+            "readings": [list(reading) for reading in readings],
+        }
+        response = self.session.post(
+            self.url,
+            data=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+            timeout=HTTP_TIMEOUT,
+        )
+        if 400 <= response.status_code < 500 and response.status_code not in RETRY_STATUSES:
+            raise RejectedBatch(f"{response.status_code} {response.text[:200]}")  # the flusher sets it aside
+        response.raise_for_status()  # 5xx: the flusher keeps the batch and backs off
+        rejected = response.json().get("rejected", [])
+        if rejected:  # the others were stored, only these are set aside
+            raise RejectedBatch(
+                f"{len(rejected)} readings refused, e.g. {rejected[0]['error']}", [row["index"] for row in rejected]
+            )
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,118 @@
+# Author: Victor Vu
+# File: load_generator.py
+# Description: Simulates N tanks x M sensors at accelerated time against the ingest path and times queries
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import argparse
+import time
+import numpy as np
+import tds_sensor
+import temp_sensor
+import turb_sensor
+from connect_timer import SENSOR_INTERVAL, Reading
+from simulated import SimulatedChannel, SimulatedThermSensor
+
+KINDS = [  # (kind, sensor_type, read function) cycled through for each tank's sensors
+    ("temperature", temp_sensor.SENSOR_TYPE, temp_sensor.read_temperature),
+    ("tds", tds_sensor.SENSOR_TYPE, tds_sensor.read_tds),
+    ("turbidity", turb_sensor.SENSOR_TYPE, turb_sensor.read_sensor),
+]
+
+
+class SimulatedClock:  # Time seen by the simulated sensors, advanced by the generator
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def build_fleet(tanks, sensors, clock):  # [(tank_id, sensor_type, device, read)] for every virtual sensor
+    fleet = []
+    for tank in range(tanks):
+        for index in range(sensors):
+            kind, sensor_type, read = KINDS[index % len(KINDS)]
+            seed = tank * sensors + index  # repeatable runs
+            device = (
+                SimulatedThermSensor(clock, seed)
+                if kind == "temperature"
+                else SimulatedChannel(kind, clock, seed)
+            )
+            suffix = f" {index // len(KINDS) + 1}" if sensors > len(KINDS) else ""
+            fleet.append((f"tank{tank:03d}", f"{sensor_type}{suffix}", device, read))
+    return fleet
+
+
+def ingest(backend, fleet, clock, hours, interval, speedup, batch_size):  # Returns per-batch insert latencies
+    steps = int(hours * 3600 / interval)
+    clock.now = time.time() - steps * interval  # end the simulated history at the real "now"
+    started = time.perf_counter()
+    latencies, pending, dropped = [], [], 0
+    for step in range(steps):
+        clock.now += interval
+        for tank_id, sensor_type, device, read in fleet:
+            try:
+                pending.append(Reading(sensor_type, read(device), clock.now, tank_id=tank_id, device_id=tank_id))
+            except OSError:
+                dropped += 1  # simulated dropout, the daemon would skip it too
+            if len(pending) >= batch_size:
+                latencies.append(insert(backend, pending))
+                pending = []
+        if speedup > 0:  # run at speedup x real time instead of as fast as possible
+            time.sleep(max(0.0, started + (step + 1) * interval / speedup - time.perf_counter()))
+    if pending:
+        latencies.append(insert(backend, pending))
+    elapsed = time.perf_counter() - started
+    readings = steps * len(fleet) - dropped
+    print(f"Ingested {readings} readings ({dropped} dropouts) in {elapsed:.1f} s: {readings / elapsed:.0f} readings/s")
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"Insert batch of {batch_size}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    return latencies
+
+
+def insert(backend, readings):  # One insert_readings call, returns seconds taken
+    started = time.perf_counter()
+    backend.insert_readings(readings)
+    return time.perf_counter() - started
+
+
+def run_queries(hours, tank_id="tank000"):  # Exercise the web app's queries for one generated tank
+    import collect_database as db  # repo root is on sys.path via connect_timer
+    from storage import query_metrics
+    from storage.base import local_timestamp
+
+    query_metrics.reset()  # only report the queries, not the ingest
+    start = local_timestamp(time.time() - hours * 3600)  # stored timestamps are DEFAULT_TIME_ZONE wall time
+    db.get_latest_data(tank_id)
+    db.get_downsampled_data(start, tank_id=tank_id)
+    db.get_downsampled_data(start, method="lttb", tank_id=tank_id)
+    db.get_statistics(start, tank_id=tank_id)
+    db.get_all_data_arrays(start, tank_id=tank_id)
+    db.get_latest_data(None)  # every tank at once
+    for name, stats in query_metrics.snapshot().items():
+        print(
+            f"{name:>18}: {stats['calls']} calls, mean {stats['mean_ms']:.1f} ms, "
+            f"max {stats['max_ms']:.1f} ms, {stats['rows']} rows"
+        )
+
+
+if __name__ == "__main__":  # python sensors/load_generator.py --tanks 100 --sensors 3 --hours 24
+    parser = argparse.ArgumentParser(description="Simulated multi-tank load against DATABASE_URL")
+    parser.add_argument("--tanks", type=int, default=100, help="virtual tanks")
+    parser.add_argument("--sensors", type=int, default=3, help="sensors per tank")
+    parser.add_argument("--hours", type=float, default=24, help="simulated history to generate")
+    parser.add_argument("--interval", type=float, default=SENSOR_INTERVAL, help="seconds between reads")
+    parser.add_argument("--speedup", type=float, default=0, help="simulated seconds per real second (0 = max)")
+    parser.add_argument("--batch", type=int, default=500, help="readings per insert")
+    parser.add_argument("--skip-queries", action="store_true", help="only measure ingest")
+    args = parser.parse_args()
+
+    from collect_database import backend
+
+    backend.migrate()
+    clock = SimulatedClock(time.time())
+    fleet = build_fleet(args.tanks, args.sensors, clock)
+    ingest(backend, fleet, clock, args.hours, args.interval, args.speedup, args.batch)
+    if not args.skip_queries:
+        run_queries(args.hours)
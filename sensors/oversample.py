@@ -0,0 +1,30 @@
+# Author: Victor Vu
+# File: oversample.py
+# Description: Burst oversampling of the analog sensors, summarized on the Pi before storage
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import os
+import numpy as np
+from connect_timer import Reading
+
+BURST_SAMPLES = int(os.getenv("BURST_SAMPLES", "64"))  # samples per reading (1 turns oversampling off)
+
+
+class BurstSampler:  # Fills a reused buffer with raw samples and reduces it to one Reading
+    def __init__(self, samples=BURST_SAMPLES):
+        self.buffer = np.empty(samples, dtype=np.float64)  # allocated once, reused every cycle
+
+    def read(self, sensor_type, read_raw, convert, recorded_at):  # read_raw() -> voltage, convert(array) -> values
+        for i in range(len(self.buffer)):
+            self.buffer[i] = read_raw()
+        values = convert(self.buffer)  # the sensor formulas work on whole arrays
+        return Reading(
+            sensor_type,
+            float(np.median(values)),  # stored value, a single noisy sample cannot move it
+            recorded_at,
+            value_mean=float(values.mean()),
+            value_min=float(values.min()),
+            value_max=float(values.max()),
+            value_std=float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+            sample_count=len(values),
+        )
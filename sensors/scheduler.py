@@ -0,0 +1,25 @@
+# Author: Victor Vu
+# File: scheduler.py
+# Description: Asyncio scheduler that fires sensor jobs on absolute wall-clock ticks
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import asyncio
+import time
+from connect_timer import next_tick
+
+
+async def ticks(interval, offset=0.0):  # Yield ticks at multiples of interval (+offset) since the epoch
+    last = time.time()
+    while True:
+        tick = next_tick(max(time.time(), last), interval, offset)  # missed ticks are skipped, never queued
+        await asyncio.sleep(max(0.0, tick - time.time()))
+        last = tick
+        yield tick
+
+
+async def every(interval, job, offset=0.0):  # Await job(tick) on every tick, a failing run does not stop it
+    async for tick in ticks(interval, offset):
+        try:
+            await job(tick)
+        except Exception as e:
+            print(f"Error in scheduled job: {e}")
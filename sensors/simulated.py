@@ -0,0 +1,60 @@
+# Author: Victor Vu
+# File: simulated.py
+# Description: Simulated sensor devices (SENSOR_DRIVER=sim) with drift, noise, spikes and dropouts
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import math
+import random
+import time
+
+DAY = 86400  # seconds in the daily cycle
+
+PROFILES = {  # sensor kind: raw signal of a healthy tank (volts for analog channels, °C for the DS18B20)
+    "tds": {"base": 1.15, "daily": 0.03, "drift": 0.002, "noise": 0.01, "spike": 0.6, "floor": 0.0},  # ~250 ppm
+    "turbidity": {"base": 0.006, "daily": 0.001, "drift": 0.0002, "noise": 0.0005, "spike": 0.02, "floor": 0.0},  # ~5 NTU
+    "temperature": {"base": 25.0, "daily": 0.8, "drift": 0.05, "noise": 0.05, "spike": 3.0, "floor": None},
+}
+SPIKE_RATE = 0.002  # chance that a sample is a spike (bubble, bumped probe)
+DROPOUT_RATE = 0.001  # chance that a read fails like a loose wire or bus error
+
+
+class SimulatedSignal:  # Daily cycle + mean-reverting drift + noise, with occasional spikes and dropouts
+    def __init__(self, kind, clock=time.time, seed=None):
+        self.profile = PROFILES[kind]
+        self.clock = clock  # the load generator passes an accelerated clock
+        self.random = random.Random(seed)
+        self.phase = self.random.uniform(0, DAY)  # tanks do not peak at the same time
+        self.drift = 0.0
+        self.last = None
+
+    def sample(self):
+        now = self.clock()
+        p = self.profile
+        if self.last is not None:  # random walk pulled back towards 0, scaled by elapsed time
+            elapsed = max(0.0, now - self.last) / 3600
+            self.drift += self.random.gauss(0, p["drift"] * math.sqrt(elapsed)) - 0.01 * self.drift * elapsed
+        self.last = now
+        if self.random.random() < DROPOUT_RATE:
+            raise OSError("simulated sensor dropout")
+        value = p["base"] + p["daily"] * math.sin(2 * math.pi * (now + self.phase) / DAY) + self.drift
+        value += self.random.gauss(0, p["noise"])
+        if self.random.random() < SPIKE_RATE:
+            value += p["spike"] * self.random.choice((-1, 1))
+        return value if p["floor"] is None else max(value, p["floor"])  # voltages never go negative
+
+
+class SimulatedChannel:  # Stands in for adafruit_ads1x15 AnalogIn
+    def __init__(self, kind, clock=time.time, seed=None):
+        self.signal = SimulatedSignal(kind, clock, seed)
+
+    @property
+    def voltage(self):
+        return self.signal.sample()
+
+
+class SimulatedThermSensor:  # Stands in for w1thermsensor.W1ThermSensor
+    def __init__(self, clock=time.time, seed=None):
+        self.signal = SimulatedSignal("temperature", clock, seed)
+
+    def get_temperature(self):  # Celsius, like the real sensor
+        return self.signal.sample()
@@ -3,40 +3,30 @@
 # Description: Reads temp from a DS18B20 sensor and outpu in Fahrenheit
 # Copyright (C) 2025 Victor V. Vu and Jordan Morris
 # License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
-from w1thermsensor import W1ThermSensor
-from connect_timer import control_timer, create_connection
+from connect_timer import SENSOR_DRIVER, control_timer, insert_reading
 
-connection = create_connection()  # Create a connection to the database
-sensor = W1ThermSensor()  # Create a sensor object
+SENSOR_TYPE = "temperature"
 
 
-def insert_data_into_db(  # Function to insert data into the database
-    sensor_type, value
-):
-    try:
-        with connection.cursor() as cursor:  # cursor object
-            sql = "INSERT INTO sensor_data (sensor_type, value, timestamp) VALUES (%s, %s, NOW())"  # sql query
-            cursor.execute(sql, (sensor_type, value))  # execute the query
-            connection.commit()  # commit the changes
+def open_sensor():  # Create a sensor object for the DS18B20 on the 1-Wire bus
+    if SENSOR_DRIVER == "sim":
+        from simulated import SimulatedThermSensor
 
-    except Exception as e:  # Catch any errors
-        print(f"Error inserting data into database: {e}")
-        reconnect_to_db()  # attempt to reconnect to the database
+        return SimulatedThermSensor()
+    from w1thermsensor import W1ThermSensor
 
+    return W1ThermSensor()
 
-def reconnect_to_db():  # Function to reconnect to the database
-    global connection
-    try:
-        connection.close()  # close the existing connection
-    except Exception as e:
-        print(f"Error closing the connection: {e}")
-    connection = create_connection()  # recreate the connection
 
-
-# Main loop to read and store the temperature value
-while True:
+def read_temperature(sensor):  # Read the temperature in Fahrenheit
     celsius = sensor.get_temperature()  # get the temperature in Celsius
-    fahrenheit = celsius * 9 / 5 + 32  # convert to Fahrenheit
-    print(f"Temperature: {fahrenheit} °F")
-    insert_data_into_db("temperature", fahrenheit)  # insert the temps in database
-    control_timer()  # wait for a specified time
+    return celsius * 9 / 5 + 32  # convert to Fahrenheit
+
+
+if __name__ == "__main__":  # Read only this sensor (acquisition.py reads all of them together)
+    sensor = open_sensor()
+    while True:  # Main loop to read and store the temperature value
+        fahrenheit = read_temperature(sensor)
+        print(f"Temperature: {fahrenheit} °F")
+        insert_reading(SENSOR_TYPE, fahrenheit)  # insert the temps in database
+        control_timer()  # wait for a specified time
@@ -3,50 +3,36 @@
 # Description: Script for reading analog voltage from a turbidity sensor connected to an ADS1115 module
 # Copyright (C) 2025 Victor V. Vu and Jordan Morris
 # License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
-import board
-import busio
-from adafruit_ads1x15.analog_in import AnalogIn
-import adafruit_ads1x15.ads1115 as ADS
-from connect_timer import create_connection, control_timer
+from analog import open_ads
+from connect_timer import SENSOR_DRIVER, control_timer, insert_reading
 
-connection = create_connection()  # Create a connection to the database
-i2c = busio.I2C(
-    board.SCL, board.SDA
-)  # I2C interface that reads from GPIO pins SCL and SDA
-ads = ADS.ADS1115(i2c)  # ADS1115 object that converts the analog signal to digital
-channel_3 = AnalogIn(ads, ADS.P3)  # Read from analog input channel on Pin 3
+SENSOR_TYPE = "turbidity"
 
 
-def read_turbidity(analog_voltage):  # Uses analog voltage to find turbidity
+def open_sensor(ads=None):  # Read from analog input channel on Pin 3
+    if SENSOR_DRIVER == "sim":
+        from simulated import SimulatedChannel
+
+        return SimulatedChannel("turbidity")
+    from adafruit_ads1x15.analog_in import AnalogIn
+    import adafruit_ads1x15.ads1115 as ADS
+
+    return AnalogIn(ads or open_ads(), ADS.P3)
+
+
+def read_turbidity(analog_voltage):  # Uses analog voltage (or an array of them) to find turbidity
     turbidity = (analog_voltage / 5.0) * 4550  # convert voltage to turbidity
     return turbidity
 
 
-def insert_data_into_db(
-    sensor_type, value
-):  # Function to insert data into the database
-    try:
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO sensor_data (sensor_type, value, timestamp) VALUES (%s, %s, NOW())"
-            cursor.execute(sql, (sensor_type, value))  # execute the query
-            connection.commit()  # commit to the database
-    except Exception as e:
-        print(f"Error inserting data into database: {e}")
-        reconnect_to_db()  # attempt to reconnect to the database
-
-
-def reconnect_to_db():  # Function to reconnect to the database
-    global connection
-    try:
-        connection.close()  # close the existing connection
-    except Exception as e:
-        print(f"Error closing the connection: {e}")
-    connection = create_connection()  # recreate the connection
-
-
-while True:  # Main loop to read and store the turbidity value
-    voltage = channel_3.voltage  # read voltage from the sensor
-    turbidity = read_turbidity(voltage)  # read turbidity value
-    print(f"Turbidity: {turbidity} NTU")
-    insert_data_into_db("turbidity", turbidity)  # insert turbidity data indatabase
-    control_timer()  # wait for a specified time
+def read_sensor(channel):  # Sample the channel and convert to NTU
+    return read_turbidity(channel.voltage)
+
+
+if __name__ == "__main__":  # Read only this sensor (acquisition.py reads all of them together)
+    channel_3 = open_sensor()
+    while True:  # Main loop to read and store the turbidity value
+        turbidity = read_sensor(channel_3)  # read turbidity value
+        print(f"Turbidity: {turbidity} NTU")
+        insert_reading(SENSOR_TYPE, turbidity)  # insert turbidity data indatabase
+        control_timer()  # wait for a specified time
@@ -0,0 +1,39 @@
+# Author: Victor Vu and Jordan Morris
+# File: storage/__init__.py
+# Description: Picks the storage backend (MySQL or embedded SQLite) from the database URL
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+from urllib.parse import urlparse
+from storage.base import (
+    StorageBackend,
+    Reading,
+    DEFAULT_TANK_ID,
+    DEFAULT_TIME_ZONE,
+    LATEST_TIME_ZONE,
+    ROLLUP_TABLES,
+    STREAM_CHUNK_SIZE,
+)
+from storage.metrics import query_metrics
+
+
+def get_backend(url, **options):  # sqlite:///path -> SQLiteBackend, anything else -> MySQLBackend
+    if urlparse(url).scheme == "sqlite":
+        from storage.sqlite_backend import SQLiteBackend  # no pymysql needed for SQLite
+
+        return SQLiteBackend(url, **options)
+    from storage.mysql_backend import MySQLBackend
+
+    return MySQLBackend(url, **options)
+
+
+__all__ = [
+    "StorageBackend",
+    "Reading",
+    "DEFAULT_TANK_ID",
+    "DEFAULT_TIME_ZONE",
+    "LATEST_TIME_ZONE",
+    "ROLLUP_TABLES",
+    "STREAM_CHUNK_SIZE",
+    "get_backend",
+    "query_metrics",
+]
@@ -0,0 +1,95 @@
+# Author: Victor Vu and Jordan Morris
+# File: storage/archive.py
+# Description: Cold tier of sensor history, one Parquet file per archived month
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import os
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from storage.base import DEFAULT_TANK_ID, STREAM_CHUNK_SIZE, as_datetime, next_month
+
+SCHEMA = pa.schema(  # tank_id, then the same columns as a sensor_data range query
+    [
+        ("tank_id", pa.string()),
+        ("sensor_type", pa.string()),
+        ("value", pa.float64()),
+        ("timestamp", pa.timestamp("us")),  # DEFAULT_TIME_ZONE wall-clock time, like the hot tier
+    ]
+)
+
+
+class ParquetArchive:  # Months moved out of the database by retention.py
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, month):  # datetime(2025, 1, 1) -> <directory>/sensor_data_2025-01.parquet
+        return os.path.join(self.directory, f"sensor_data_{month:%Y-%m}.parquet")
+
+    def months(self):  # Archived months, oldest first
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            datetime.strptime(name[len("sensor_data_"):-len(".parquet")], "%Y-%m")
+            for name in os.listdir(self.directory)
+            if name.startswith("sensor_data_") and name.endswith(".parquet")
+        )
+
+    def end(self):  # Everything before this instant is in the archive (None if it is empty)
+        months = self.months()
+        return next_month(months[-1]) if months else None
+
+    def read_month(self, month, filters=None):  # One archived month as a table in SCHEMA
+        table = pq.read_table(self.path(month), filters=filters)
+        if "tank_id" not in table.column_names:  # written before tanks existed
+            table = table.add_column(0, "tank_id", pa.array([DEFAULT_TANK_ID] * table.num_rows, pa.string()))
+        return table.select(SCHEMA.names).cast(SCHEMA)
+
+    def write_month(self, month, chunks):  # Store chunks of (tank_id, sensor_type, value, timestamp) rows
+        tables = [
+            pa.Table.from_arrays([pa.array(column) for column in zip(*rows)], schema=SCHEMA)
+            for rows in chunks
+        ]
+        if not tables:
+            return 0
+        if os.path.exists(self.path(month)):  # late rows for a month archived before
+            tables.insert(0, self.read_month(month))
+        table = pa.concat_tables(tables).sort_by("timestamp")
+        os.makedirs(self.directory, exist_ok=True)
+        partial = self.path(month) + ".partial"
+        pq.write_table(table, partial, compression="zstd")
+        os.replace(partial, self.path(month))  # readers never see a half-written file
+        return table.num_rows
+
+    def tables(self, start_date=None, end_date=None, tank_id=None):  # Tables of each month overlapping a range
+        start, end = as_datetime(start_date), as_datetime(end_date)
+        for month in self.months():
+            if (start is not None and next_month(month) <= start) or (end is not None and month > end):
+                continue  # file cannot overlap the range
+            filters = []
+            if start is not None:
+                filters.append(("timestamp", ">=", start))
+            if end is not None:
+                filters.append(("timestamp", "<=", end))
+            table = self.read_month(month, filters or None)
+            if tank_id is not None:
+                table = table.filter(pc.equal(table["tank_id"], tank_id))
+            yield table
+
+    def extent(self, start_date=None, end_date=None, tank_id=None):  # (first, last) archived timestamp in a range
+        first = last = None
+        for table in self.tables(start_date, end_date, tank_id):
+            if table.num_rows:
+                bounds = pc.min_max(table["timestamp"])
+                first = first or bounds["min"].as_py()  # months are read oldest first
+                last = bounds["max"].as_py()
+        return first, last
+
+    def iter_range(
+        self, start_date=None, end_date=None, chunk_size=STREAM_CHUNK_SIZE, tank_id=None
+    ):  # Stream (sensor_type, value, timestamp) rows of one tank (None = all) ordered by timestamp
+        for table in self.tables(start_date, end_date, tank_id):
+            for batch in table.drop_columns(["tank_id"]).to_batches(max_chunksize=chunk_size):
+                if batch.num_rows:
+                    yield list(zip(*(column.to_pylist() for column in batch.columns)))
@@ -0,0 +1,341 @@
+# Author: Victor Vu and Jordan Morris
+# File: storage/base.py
+# Description: Storage backend interface shared by the MySQL and SQLite implementations
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import csv
+import time
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from storage.metrics import query_metrics, estimate_bytes
+
+DEFAULT_TIME_ZONE = "-08:00"  # session time zone for range queries (PST)
+LATEST_TIME_ZONE = "-09:00"  # time zone for latest readings (-1/2 hrs for daylight savings)
+STREAM_CHUNK_SIZE = 5000  # rows fetched per round trip when streaming ranges
+ROLLUP_TABLES = {  # granularity: (table, bucket width in seconds), bucketed in DEFAULT_TIME_ZONE
+    "hourly": ("sensor_rollup_hourly", 3600),
+    "daily": ("sensor_rollup_daily", 86400),
+}
+ROLLUP_RESETS = {  # granularity: datetime fields cleared to get the bucket start
+    "hourly": {"minute": 0, "second": 0, "microsecond": 0},
+    "daily": {"hour": 0, "minute": 0, "second": 0, "microsecond": 0},
+}
+
+DEFAULT_TANK_ID = "default"  # tank (and device) of rows written before tanks existed
+# Summary columns of an oversampled reading (NULL for single-sample readings)
+AGGREGATE_COLUMNS = ["value_mean", "value_min", "value_max", "value_std", "sample_count"]
+# One sensor reading to store. recorded_at is epoch seconds, or None for "now" on the database.
+# An oversampled reading stores the burst median as value, plus the burst aggregates.
+# tank_id/device_id of None are stored as DEFAULT_TANK_ID
+Reading = namedtuple(
+    "Reading",
+    ["sensor_type", "value", "recorded_at", *AGGREGATE_COLUMNS, "tank_id", "device_id"],
+    defaults=[None] * (3 + len(AGGREGATE_COLUMNS)),
+)
+
+
+def utc_offset(time_zone):  # "-08:00" -> tzinfo
+    sign = -1 if time_zone.startswith("-") else 1
+    hours, minutes = time_zone.lstrip("+-").split(":")
+    return timezone(sign * timedelta(hours=int(hours), minutes=int(minutes)))
+
+
+def local_timestamp(recorded_at=None, time_zone=DEFAULT_TIME_ZONE):  # Naive wall-clock time in time_zone
+    moment = (
+        datetime.now(timezone.utc)
+        if recorded_at is None
+        else datetime.fromtimestamp(recorded_at, timezone.utc)
+    )
+    return moment.astimezone(utc_offset(time_zone)).replace(tzinfo=None, microsecond=0)
+
+
+def as_datetime(value):  # Accept the "2025/01/12" style dates the graphs page sends
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("/", "-"))
+    return value
+
+
+def month_start(moment):  # First instant of the month containing a naive datetime
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):  # First instant of the following month
+    start = month_start(moment)
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def local_epoch(moment, time_zone=DEFAULT_TIME_ZONE):  # Naive wall-clock time in time_zone -> epoch seconds
+    return int(moment.replace(tzinfo=utc_offset(time_zone)).timestamp())
+
+
+def aggregate_values(reading):  # Aggregate columns of a Reading, ready for an INSERT
+    return tuple(
+        None if value is None else (int(value) if column == "sample_count" else float(value))
+        for column, value in zip(AGGREGATE_COLUMNS, reading[3:])
+    )
+
+
+def reading_rows(readings, now):  # (tank_id, sensor_type, value, timestamp) rows, plus raw INSERT rows
+    rows, raw_rows = [], []
+    for reading in readings:
+        row = (
+            reading.tank_id or DEFAULT_TANK_ID,
+            reading.sensor_type,
+            float(reading.value),
+            now if reading.recorded_at is None else local_timestamp(reading.recorded_at),
+        )
+        rows.append(row)
+        raw_rows.append((*row, reading.device_id or DEFAULT_TANK_ID, *aggregate_values(reading)))
+    return rows, raw_rows
+
+
+def range_filter(
+    start_date=None, end_date=None, column="timestamp", placeholder="%s", tank_id=None
+):  # WHERE clause for optional date bounds and tank (None = every tank)
+    conditions, params = [], []
+    if tank_id is not None:
+        conditions.append(f"tank_id = {placeholder}")
+        params.append(tank_id)
+    if start_date is not None:
+        conditions.append(f"{column} >= {placeholder}")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= {placeholder}")
+        params.append(end_date)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+def rollup_deltas(rows):  # Fold (tank_id, sensor_type, value, timestamp) rows into per-bucket rollup deltas
+    deltas = {}  # (table, tank_id, sensor_type, bucket_start) -> [count, min, max, sum, sum of squares]
+    for tank_id, sensor_type, value, timestamp in rows:
+        for granularity, (table, _) in ROLLUP_TABLES.items():
+            key = (table, tank_id, sensor_type, timestamp.replace(**ROLLUP_RESETS[granularity]))
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = [1, value, value, value, value * value]
+            else:
+                delta[0] += 1
+                delta[1] = min(delta[1], value)
+                delta[2] = max(delta[2], value)
+                delta[3] += value
+                delta[4] += value * value
+    by_table = {}  # table -> rows ready for an upsert
+    for (table, tank_id, sensor_type, bucket_start), delta in deltas.items():
+        by_table.setdefault(table, []).append((tank_id, sensor_type, bucket_start, *delta))
+    return by_table
+
+
+class StorageBackend:  # Insert, latest, range, rollup and export operations over one database
+    placeholder = "%s"  # DB-API parameter style
+    explain_prefix = "EXPLAIN "
+    migrations = []  # (version, description, statements) applied in order
+
+    # Query templates ({where}/{table} are filled in per call), defined by each backend
+    LATEST_QUERY = RANGE_QUERY = EXTENT_QUERY = NEW_ROWS_QUERY = MAX_ID_QUERY = None
+    BUCKET_QUERY = ROLLUP_BUCKET_QUERY = STATISTICS_QUERY = None
+
+    def connection(self, time_zone=DEFAULT_TIME_ZONE):  # Context manager yielding a DB-API connection
+        raise NotImplementedError
+
+    def insert_readings(self, readings):  # Store Readings with their latest value and rollups atomically
+        raise NotImplementedError
+
+    def backfill_rollups(self, start_date=None, end_date=None):  # Recompute rollups from raw rows (all tanks)
+        raise NotImplementedError
+
+    def ensure_partitions(self, first_month, last_month):  # Monthly partitions covering these months
+        pass  # only backends with native partitioning need to do anything
+
+    def drop_month(self, month):  # Remove the raw rows of one month after it has been archived
+        p = self.placeholder
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            cursor.execute(
+                f"DELETE FROM sensor_data WHERE timestamp >= {p} AND timestamp < {p}",
+                (month, next_month(month)),
+            )
+            return cursor.rowcount
+
+    def ping(self):  # True if the database is reachable
+        try:
+            with self.connection() as conn, closing(conn.cursor()) as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def close(self):  # Release any open connections
+        pass
+
+    def _stream_cursor(self, conn):  # Cursor that does not buffer the whole result
+        return conn.cursor()
+
+    def _range(self, start_date=None, end_date=None, column="timestamp", tank_id=None):
+        return range_filter(start_date, end_date, column, self.placeholder, tank_id)
+
+    def tanks(self):  # Every tank_id that has reported a reading
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            cursor.execute("SELECT DISTINCT tank_id FROM sensor_latest ORDER BY tank_id")
+            return [row[0] for row in cursor.fetchall()]
+
+    def latest(self, tank_id=None):  # {sensor_type: {"value", "timestamp"}} for the newest reading of each sensor
+        where, params = self._range(tank_id=tank_id)  # every tank: keyed by (tank_id, sensor_type) instead
+        with query_metrics.timed("latest") as record, self.connection(LATEST_TIME_ZONE) as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(self.LATEST_QUERY.format(where=where), params)
+                rows = record.result(cursor.fetchall())
+        return {
+            (row[1] if tank_id is not None else (row[0], row[1])): {"value": row[2], "timestamp": row[3]}
+            for row in rows
+        }
+
+    def iter_range(
+        self, start_date=None, end_date=None, chunk_size=STREAM_CHUNK_SIZE, tank_id=None
+    ):  # Stream (sensor_type, value, timestamp) rows in chunks ordered by timestamp
+        where, params = self._range(start_date, end_date, tank_id=tank_id)  # open-ended when no range provided
+        elapsed, row_count, nbytes, error = 0.0, 0, 0, False  # only time spent in the database counts
+        try:
+            with self.connection() as conn, closing(self._stream_cursor(conn)) as cursor:
+                started = time.perf_counter()
+                cursor.execute(self.RANGE_QUERY.format(where=where), params)
+                elapsed += time.perf_counter() - started
+                while True:
+                    started = time.perf_counter()
+                    rows = cursor.fetchmany(chunk_size)
+                    elapsed += time.perf_counter() - started
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                    nbytes += estimate_bytes(rows)
+                    yield rows
+        except Exception:
+            error = True
+            raise
+        finally:
+            query_metrics.record("iter_range", elapsed * 1000, row_count, nbytes, error)
+
+    def extent(self, start_date=None, end_date=None, tank_id=None):  # (first, last) timestamp in a range
+        where, params = self._range(start_date, end_date, tank_id=tank_id)
+        with query_metrics.timed("extent") as record, self.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(self.EXTENT_QUERY.format(where=where), params)
+                return record.result([cursor.fetchone()])[0]
+
+    def max_id(self):  # Highest sensor_data id so far (ids grow with every insert), 0 if empty
+        with query_metrics.timed("max_id") as record, self.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(self.MAX_ID_QUERY)
+                return record.result([cursor.fetchone()])[0][0] or 0
+
+    def rows_since(self, last_id, tank_id=None):  # (id, sensor_type, value, timestamp) rows inserted after last_id
+        where, params = self._range(tank_id=tank_id)
+        where = f"{where} AND id > {self.placeholder}" if where else f"WHERE id > {self.placeholder}"
+        with query_metrics.timed("rows_since") as record, self.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(self.NEW_ROWS_QUERY.format(where=where), (*params, last_id))
+                return record.result(cursor.fetchall())
+
+    def buckets(
+        self, start_date, end_date, origin, bucket_seconds, rollup_table=None, tank_id=None
+    ):  # (sensor_type, timestamp, avg, min, max) per time bucket, from raw rows or a rollup
+        if rollup_table:
+            where, params = self._range(start_date, end_date, "bucket_start", tank_id)
+            sql = self.ROLLUP_BUCKET_QUERY.format(table=rollup_table, where=where)
+        else:
+            where, params = self._range(start_date, end_date, tank_id=tank_id)
+            sql = self.BUCKET_QUERY.format(where=where)
+        name = "buckets (rollup)" if rollup_table else "buckets (raw)"
+        with query_metrics.timed(name) as record, self.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(sql, (*params, origin, bucket_seconds))
+                return record.result(cursor.fetchall())
+
+    def rollup_totals(
+        self, start_date=None, end_date=None, granularity="hourly", tank_id=None
+    ):  # (sensor_type, count, min, max, sum, sum of squares) over a range of rollup buckets
+        where, params = self._range(start_date, end_date, "bucket_start", tank_id)
+        sql = self.STATISTICS_QUERY.format(table=ROLLUP_TABLES[granularity][0], where=where)
+        with query_metrics.timed("rollup_totals") as record, self.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(sql, params)
+                return record.result(cursor.fetchall())
+
+    def export_csv(self, file, start_date=None, end_date=None, tank_id=None):  # Write a range to an open CSV file
+        writer = csv.writer(file)
+        writer.writerow(["sensor_type", "value", "timestamp"])
+        for rows in self.iter_range(start_date, end_date, tank_id=tank_id):  # one chunk in memory at a time
+            writer.writerows(rows)
+
+    def applied_versions(self, cursor):  # Versions already recorded in schema_migrations
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER NOT NULL PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+    def migrate(self):  # Apply every pending migration in order
+        p = self.placeholder
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            applied = self.applied_versions(cursor)
+            for version, description, statements in self.migrations:
+                if version in applied:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    f"INSERT INTO schema_migrations (version, description) VALUES ({p}, {p})",
+                    (version, description),
+                )
+
+    def status(self):  # Print which migrations are applied
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            applied = self.applied_versions(cursor)
+        for version, description, _ in self.migrations:
+            print(f"[{'x' if version in applied else ' '}] {version}: {description}")
+
+    def named_queries(self, start, end, tank_id=DEFAULT_TANK_ID):  # (name, sql, params) as the app runs them
+        where, params = self._range(start, end, tank_id=tank_id)
+        rollup_where, rollup_params = self._range(start, end, "bucket_start", tank_id)
+        latest_where, latest_params = self._range(tank_id=tank_id)
+        hourly = ROLLUP_TABLES["hourly"][0]
+        return [
+            ("latest", self.LATEST_QUERY.format(where=latest_where), latest_params),
+            ("iter_range", self.RANGE_QUERY.format(where=where), params),
+            ("extent", self.EXTENT_QUERY.format(where=where), params),
+            ("buckets (raw)", self.BUCKET_QUERY.format(where=where), [*params, start, 3600]),
+            (
+                "buckets (rollup)",
+                self.ROLLUP_BUCKET_QUERY.format(table=hourly, where=rollup_where),
+                [*rollup_params, start, 86400],
+            ),
+            (
+                "rollup_totals",
+                self.STATISTICS_QUERY.format(table=hourly, where=rollup_where),
+                rollup_params,
+            ),
+        ]
+
+    def explain(self, days=30, tank_id=DEFAULT_TANK_ID):  # Print query plans and timings over one tank's last `days`
+        end = datetime.now()
+        start = end - timedelta(days=days)
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            for name, sql, params in self.named_queries(start, end, tank_id):
+                cursor.execute(self.explain_prefix + sql, params)
+                columns = [column[0] for column in cursor.description]
+                plan = cursor.fetchall()
+
+                started = time.perf_counter()
+                cursor.execute(sql, params)
+                row_count = len(cursor.fetchall())
+                elapsed_ms = (time.perf_counter() - started) * 1000
+
+                print(f"\n== {name}: {row_count} rows in {elapsed_ms:.1f} ms")
+                for row in plan:  # look for index-only access ("Using index" / "COVERING INDEX")
+                    print("  " + ", ".join(f"{c}={v}" for c, v in zip(columns, row) if v is not None))
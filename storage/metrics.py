@@ -0,0 +1,117 @@
+# Author: Victor Vu and Jordan Morris
+# File: storage/metrics.py
+# Description: Per-query latency histograms, row/byte counts and a slow-query log for the storage layer
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))  # calls slower than this are logged
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")  # appended to, one line per call
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # histogram upper bounds
+
+
+def estimate_bytes(rows):  # Approximate result size, sampling the first row for wide results
+    if not rows:
+        return 0
+    width = sum(len(value) if isinstance(value, str) else 8 for value in rows[0])
+    return width * len(rows)
+
+
+class QueryStats:  # Running totals for one query name
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)  # last bucket is "slower than all"
+
+    def add(self, elapsed_ms, rows, nbytes, error):
+        self.calls += 1
+        self.errors += error
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        self.bytes += nbytes
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "histogram_ms": {
+                **{f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram)},
+                f">{LATENCY_BUCKETS_MS[-1]}": self.histogram[-1],
+            },
+        }
+
+
+class QueryRecord:  # Filled in by the caller inside QueryMetrics.timed()
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+    def result(self, rows):  # Count a fetched result and return it unchanged
+        self.rows += len(rows)
+        self.bytes += estimate_bytes(rows)
+        return rows
+
+
+class QueryMetrics:  # Aggregates for every query name, shared by all threads
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self._stats = {}  # query name -> QueryStats
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, name):  # with query_metrics.timed("latest") as record: ...
+        record = QueryRecord()
+        error = False
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, record.rows, record.bytes, error)
+
+    def record(self, name, elapsed_ms, rows=0, nbytes=0, error=False):  # Add one call to the totals
+        with self._lock:
+            self._stats.setdefault(name, QueryStats()).add(elapsed_ms, rows, nbytes, error)
+        if elapsed_ms >= self.slow_query_ms:
+            self.log_slow(name, elapsed_ms, rows, error)
+
+    def log_slow(self, name, elapsed_ms, rows, error):
+        line = f"{datetime.now().isoformat(' ', 'seconds')} {name} {elapsed_ms:.1f} ms rows={rows}"
+        try:
+            with self._lock, open(self.slow_query_log, "a") as file:
+                file.write(line + (" error\n" if error else "\n"))
+        except OSError as e:
+            print(f"Error writing slow query log: {e}")
+
+    def snapshot(self):  # {query name: aggregates} for the metrics endpoint
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_metrics = QueryMetrics()  # process-wide, read by GET /metrics in main_system.py
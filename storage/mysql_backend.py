@@ -0,0 +1,430 @@
+# Author: Jordan Morris and Victor Vu
+# File: storage/mysql_backend.py
+# Description: MySQL storage backend with a bounded, thread-safe connection pool
+# Copyright (C) 2024 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import pymysql
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from storage.base import (
+    StorageBackend,
+    AGGREGATE_COLUMNS,
+    DEFAULT_TIME_ZONE,
+    ROLLUP_TABLES,
+    local_epoch,
+    next_month,
+    reading_rows,
+    rollup_deltas,
+)
+from storage.metrics import query_metrics
+
+POOL_SIZE = 5  # max open connections
+POOL_TIMEOUT = 10  # seconds to wait for a free connection
+POOL_PING_INTERVAL = 30  # only ping connections that sat idle longer than this (seconds)
+
+BUCKET_EXPRESSIONS = {  # granularity: bucket start of a raw row (matches ROLLUP_RESETS)
+    "hourly": "DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR",
+    "daily": "DATE(timestamp)",
+}
+
+
+def _rollup_table(table):  # DDL shared by the hourly and daily rollups
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            sensor_type VARCHAR(64) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            sample_count INT NOT NULL,
+            min_value DOUBLE NOT NULL,
+            max_value DOUBLE NOT NULL,
+            sum_value DOUBLE NOT NULL,
+            sum_squares DOUBLE NOT NULL,
+            PRIMARY KEY (sensor_type, bucket_start)
+        )
+    """
+
+
+# (version, description, statements) applied in order, never edit one that has shipped
+MIGRATIONS = [
+    (
+        1,
+        "create sensor_data",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS sensor_data (
+                id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                sensor_type VARCHAR(64) NOT NULL,
+                value DOUBLE NOT NULL,
+                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "index latest-per-sensor and range queries",
+        [
+            # MAX(timestamp) GROUP BY sensor_type and the join back on (sensor_type, timestamp)
+            "CREATE INDEX idx_sensor_type_timestamp ON sensor_data (sensor_type, timestamp)",
+            # WHERE timestamp range scans and buckets read only this index
+            "CREATE INDEX idx_timestamp_covering ON sensor_data (timestamp, sensor_type, value)",
+        ],
+    ),
+    (
+        3,
+        "create hourly and daily rollups",
+        [_rollup_table(table) for table, _ in ROLLUP_TABLES.values()],
+    ),
+    (
+        4,
+        "create sensor_latest maintained by ingest",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS sensor_latest (
+                sensor_type VARCHAR(64) NOT NULL PRIMARY KEY,
+                value DOUBLE NOT NULL,
+                timestamp TIMESTAMP NOT NULL
+            )
+            """,
+            """
+            INSERT INTO sensor_latest (sensor_type, value, timestamp)
+            SELECT sd.sensor_type, sd.value, sd.timestamp
+            FROM sensor_data sd
+            JOIN (
+                SELECT sensor_type, MAX(timestamp) AS max_timestamp
+                FROM sensor_data
+                GROUP BY sensor_type
+            ) latest
+            ON sd.sensor_type = latest.sensor_type AND sd.timestamp = latest.max_timestamp
+            ON DUPLICATE KEY UPDATE value = VALUES(value), timestamp = VALUES(timestamp)
+            """,
+        ],
+    ),
+    (
+        5,
+        "partition sensor_data by month",
+        [
+            # Every unique key must contain the partitioning column
+            "ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)",
+            # Starts as one catch-all partition, retention.py splits it into months
+            """
+            ALTER TABLE sensor_data PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+                PARTITION p_future VALUES LESS THAN MAXVALUE
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        "add oversampling aggregates to sensor_data",
+        [  # NULL for readings that were not oversampled
+            """
+            ALTER TABLE sensor_data
+                ADD COLUMN value_mean DOUBLE NULL,
+                ADD COLUMN value_min DOUBLE NULL,
+                ADD COLUMN value_max DOUBLE NULL,
+                ADD COLUMN value_std DOUBLE NULL,
+                ADD COLUMN sample_count INT NULL
+            """,
+        ],
+    ),
+    (
+        7,
+        "add tank_id and device_id",
+        [
+            """
+            ALTER TABLE sensor_data
+                ADD COLUMN tank_id VARCHAR(64) NOT NULL DEFAULT 'default',
+                ADD COLUMN device_id VARCHAR(64) NOT NULL DEFAULT 'default'
+            """,
+            # Per-tank range scans and buckets read only this index
+            "CREATE INDEX idx_tank_timestamp_covering ON sensor_data (tank_id, timestamp, sensor_type, value)",
+            """
+            ALTER TABLE sensor_latest
+                ADD COLUMN tank_id VARCHAR(64) NOT NULL DEFAULT 'default' FIRST,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (tank_id, sensor_type)
+            """,
+            *(
+                f"""
+                ALTER TABLE {table}
+                    ADD COLUMN tank_id VARCHAR(64) NOT NULL DEFAULT 'default' FIRST,
+                    DROP PRIMARY KEY,
+                    ADD PRIMARY KEY (tank_id, sensor_type, bucket_start)
+                """
+                for table, _ in ROLLUP_TABLES.values()
+            ),
+        ],
+    ),
+    (
+        8,
+        "drop the sensor_type index",
+        [  # latest() reads sensor_latest and range queries are per tank, so nothing reads it any more
+            "DROP INDEX idx_sensor_type_timestamp ON sensor_data",
+        ],
+    ),
+]
+
+
+def partition_name(month):  # datetime(2025, 1, 1) -> "p202501"
+    return f"p{month:%Y%m}"
+
+
+class ConnectionPool:  # Bounded pool of MySQL connections shared across threads
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.connect = connect  # connect(time_zone) -> new connection
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # reuse the most recently used (warm) connection first
+        self._slots = threading.BoundedSemaphore(size)  # limits connections checked out at once
+        self._time_zones = {}  # connection -> session time zone currently applied
+        self._last_used = {}  # connection -> time it was checked back in
+
+    def checkout(self, time_zone=DEFAULT_TIME_ZONE):  # Borrow a healthy connection
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pymysql.OperationalError("Timed out waiting for a pooled database connection")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:  # open a new connection while under the size limit
+                conn = self._open(time_zone)
+            else:
+                conn = self._check_health(conn, time_zone)
+            if self._time_zones.get(conn) != time_zone:  # only pay the round trip on change
+                with query_metrics.timed("set_time_zone"), conn.cursor() as cursor:
+                    cursor.execute(f"SET time_zone = '{time_zone}';")
+                self._time_zones[conn] = time_zone
+            return conn
+        except Exception:
+            self._slots.release()  # give the slot back if no connection was handed out
+            raise
+
+    def checkin(self, conn, discard=False):  # Return a connection to the pool
+        try:
+            if discard or not conn.open:  # drop broken connections instead of reusing them
+                self._forget(conn)
+            else:
+                self._last_used[conn] = time.monotonic()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, time_zone=DEFAULT_TIME_ZONE):  # with pool.connection() as conn:
+        conn = self.checkout(time_zone)
+        discard = False
+        try:
+            yield conn
+        except pymysql.MySQLError:
+            discard = True  # state of the connection is unknown after a driver error
+            raise
+        finally:
+            self.checkin(conn, discard)
+
+    def close_all(self):  # Close every idle connection (e.g. on shutdown)
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._forget(conn)
+
+    def _open(self, time_zone):
+        conn = self.connect(time_zone)
+        self._time_zones[conn] = time_zone
+        return conn
+
+    def _check_health(self, conn, time_zone):  # Ping connections that sat idle for a while
+        idle_for = time.monotonic() - self._last_used.get(conn, 0)
+        if idle_for < POOL_PING_INTERVAL:
+            return conn
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except pymysql.MySQLError:
+            self._forget(conn)
+            return self._open(time_zone)
+
+    def _forget(self, conn):
+        self._time_zones.pop(conn, None)
+        self._last_used.pop(conn, None)
+        try:
+            conn.close()
+        except pymysql.MySQLError:
+            pass  # already closed by the server
+
+
+class MySQLBackend(StorageBackend):  # Readings stored in MySQL (DATABASE_URL=mysql://...)
+    migrations = MIGRATIONS
+
+    LATEST_QUERY = "SELECT tank_id, sensor_type, value, timestamp FROM sensor_latest {where}"  # kept current by ingest
+    RANGE_QUERY = """
+        SELECT sensor_type, value, timestamp
+        FROM sensor_data
+        {where}
+        ORDER BY timestamp
+    """
+    EXTENT_QUERY = "SELECT MIN(timestamp), MAX(timestamp) FROM sensor_data {where}"
+    NEW_ROWS_QUERY = """
+        SELECT id, sensor_type, value, timestamp
+        FROM sensor_data
+        {where}
+        ORDER BY id
+    """
+    MAX_ID_QUERY = "SELECT MAX(id) FROM sensor_data"
+    BUCKET_QUERY = """
+        SELECT sensor_type, MIN(timestamp), AVG(value), MIN(value), MAX(value)
+        FROM sensor_data
+        {where}
+        GROUP BY sensor_type, FLOOR((UNIX_TIMESTAMP(timestamp) - UNIX_TIMESTAMP(%s)) / %s)
+        ORDER BY MIN(timestamp)
+    """
+    ROLLUP_BUCKET_QUERY = """
+        SELECT sensor_type, MIN(bucket_start), SUM(sum_value) / SUM(sample_count),
+               MIN(min_value), MAX(max_value)
+        FROM {table}
+        {where}
+        GROUP BY sensor_type, FLOOR((UNIX_TIMESTAMP(bucket_start) - UNIX_TIMESTAMP(%s)) / %s)
+        ORDER BY MIN(bucket_start)
+    """
+    STATISTICS_QUERY = """
+        SELECT sensor_type, SUM(sample_count), MIN(min_value), MAX(max_value),
+               SUM(sum_value), SUM(sum_squares)
+        FROM {table}
+        {where}
+        GROUP BY sensor_type
+    """
+    INSERT_QUERY = f"""
+        INSERT INTO sensor_data
+            (tank_id, sensor_type, value, timestamp, device_id, {", ".join(AGGREGATE_COLUMNS)})
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    LATEST_UPSERT = """
+        INSERT INTO sensor_latest (tank_id, sensor_type, value, timestamp) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            value = IF(VALUES(timestamp) >= timestamp, VALUES(value), value),
+            timestamp = GREATEST(timestamp, VALUES(timestamp))
+    """
+    ROLLUP_UPSERT = """
+        INSERT INTO {table}
+            (tank_id, sensor_type, bucket_start, sample_count, min_value, max_value, sum_value, sum_squares)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            sample_count = sample_count + VALUES(sample_count),
+            min_value = LEAST(min_value, VALUES(min_value)),
+            max_value = GREATEST(max_value, VALUES(max_value)),
+            sum_value = sum_value + VALUES(sum_value),
+            sum_squares = sum_squares + VALUES(sum_squares)
+    """
+
+    def __init__(self, url, pool_size=POOL_SIZE, pool_timeout=POOL_TIMEOUT):
+        self.url = urlparse(url)
+        self.pool = ConnectionPool(self._connect, pool_size, pool_timeout)
+
+    def _connect(self, time_zone):  # Establish MySQL connection
+        return pymysql.connect(
+            host=self.url.hostname,
+            user=self.url.username,
+            password=self.url.password,
+            database=self.url.path[1:],
+            port=self.url.port,
+            autocommit=True,  # autocommit to refresh data
+            init_command=f"SET time_zone = '{time_zone}'",  # session setup on connect
+        )
+
+    def connection(self, time_zone=DEFAULT_TIME_ZONE):
+        return self.pool.connection(time_zone)
+
+    def close(self):
+        self.pool.close_all()
+
+    def _stream_cursor(self, conn):  # Unbuffered server-side cursor: rows stay on the server until fetched
+        return conn.cursor(pymysql.cursors.SSCursor)
+
+    def insert_readings(self, readings):
+        if not readings:
+            return
+        with query_metrics.timed("insert_readings") as record, self.connection() as conn:
+            record.rows = len(readings)
+            conn.begin()  # raw rows, latest values and rollups are written in one transaction
+            try:
+                with conn.cursor() as cursor:
+                    now = None
+                    if any(reading.recorded_at is None for reading in readings):
+                        cursor.execute("SELECT NOW()")  # one database timestamp for the batch
+                        (now,) = cursor.fetchone()
+                    rows, raw_rows = reading_rows(readings, now)
+                    cursor.executemany(self.INSERT_QUERY, raw_rows)  # sent as one multi-row INSERT
+                    cursor.executemany(self.LATEST_UPSERT, rows)
+                    for table, deltas in rollup_deltas(rows).items():
+                        cursor.executemany(self.ROLLUP_UPSERT.format(table=table), deltas)
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except pymysql.MySQLError:
+                    pass  # connection is gone, nothing was committed
+                raise
+
+    def partitions(self, cursor):  # Monthly partition names of sensor_data (p_future excluded)
+        cursor.execute("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sensor_data'
+              AND PARTITION_NAME IS NOT NULL AND PARTITION_NAME <> 'p_future'
+        """)
+        return sorted(row[0] for row in cursor.fetchall())
+
+    def ensure_partitions(self, first_month, last_month):  # Split p_future into monthly partitions
+        with self.connection() as conn, conn.cursor() as cursor:
+            existing = self.partitions(cursor)
+            month, new = first_month, []
+            while month <= last_month:
+                # p_future can only be split above the newest existing boundary
+                if not existing or partition_name(month) > existing[-1]:
+                    boundary = local_epoch(next_month(month))  # rows before the next month
+                    new.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ({boundary})")
+                month = next_month(month)
+            if new:
+                cursor.execute(f"""
+                    ALTER TABLE sensor_data REORGANIZE PARTITION p_future INTO (
+                        {", ".join(new)},
+                        PARTITION p_future VALUES LESS THAN MAXVALUE
+                    )
+                """)
+                print(f"sensor_data: {len(new)} partitions added")
+
+    def drop_month(self, month):  # Drop the month's partition (instant), or delete its rows
+        with self.connection() as conn, conn.cursor() as cursor:
+            if partition_name(month) in self.partitions(cursor):
+                # Older months were archived first, so the partition only holds this month
+                cursor.execute(f"ALTER TABLE sensor_data DROP PARTITION {partition_name(month)}")
+                return cursor.rowcount
+        return super().drop_month(month)
+
+    def backfill_rollups(self, start_date=None, end_date=None):  # use midnight bounds
+        where, params = self._range(start_date, end_date)
+        with self.connection() as conn, conn.cursor() as cursor:
+            for granularity, (table, _) in ROLLUP_TABLES.items():
+                bucket = BUCKET_EXPRESSIONS[granularity]
+                # Whole buckets are replaced, so running this twice gives the same result
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table}
+                        (tank_id, sensor_type, bucket_start, sample_count, min_value, max_value, sum_value, sum_squares)
+                    SELECT tank_id, sensor_type, {bucket}, COUNT(*), MIN(value), MAX(value),
+                           SUM(value), SUM(value * value)
+                    FROM sensor_data
+                    {where}
+                    GROUP BY tank_id, sensor_type, {bucket}
+                    ON DUPLICATE KEY UPDATE
+                        sample_count = VALUES(sample_count),
+                        min_value = VALUES(min_value),
+                        max_value = VALUES(max_value),
+                        sum_value = VALUES(sum_value),
+                        sum_squares = VALUES(sum_squares)
+                """,
+                    params,
+                )
+                print(f"{table}: {cursor.rowcount} rows written")
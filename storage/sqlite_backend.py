@@ -0,0 +1,326 @@
+# Author: Victor Vu and Jordan Morris
+# File: storage/sqlite_backend.py
+# Description: Embedded SQLite storage backend (WAL mode) for single-Pi deployments and benchmarks
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime
+from storage.base import (
+    StorageBackend,
+    AGGREGATE_COLUMNS,
+    DEFAULT_TIME_ZONE,
+    LATEST_TIME_ZONE,
+    ROLLUP_TABLES,
+    as_datetime,
+    local_timestamp,
+    reading_rows,
+    rollup_deltas,
+    utc_offset,
+)
+from storage.metrics import query_metrics
+
+# Timestamps are stored as "YYYY-MM-DD HH:MM:SS" text in DEFAULT_TIME_ZONE wall-clock time
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+BUCKET_EXPRESSIONS = {  # granularity: bucket start of a raw row (matches ROLLUP_RESETS)
+    "hourly": "strftime('%Y-%m-%d %H:00:00', timestamp)",
+    "daily": "strftime('%Y-%m-%d 00:00:00', timestamp)",
+}
+
+
+def _rollup_table(table):  # DDL shared by the hourly and daily rollups
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            sensor_type TEXT NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            sample_count INTEGER NOT NULL,
+            min_value REAL NOT NULL,
+            max_value REAL NOT NULL,
+            sum_value REAL NOT NULL,
+            sum_squares REAL NOT NULL,
+            PRIMARY KEY (sensor_type, bucket_start)
+        )
+    """
+
+
+def _rebuild_with_tank(table, create, columns):  # Statements copying a table into a new tank-keyed one
+    return [
+        f"ALTER TABLE {table} RENAME TO {table}_old",
+        create,
+        f"INSERT INTO {table} (tank_id, {columns}) SELECT 'default', {columns} FROM {table}_old",
+        f"DROP TABLE {table}_old",
+    ]
+
+
+# Same versions as the MySQL migrations so `migrations.py status` reads the same on both
+MIGRATIONS = [
+    (
+        1,
+        "create sensor_data",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS sensor_data (
+                id INTEGER PRIMARY KEY,
+                sensor_type TEXT NOT NULL,
+                value REAL NOT NULL,
+                timestamp TIMESTAMP NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "index latest-per-sensor and range queries",
+        [
+            "CREATE INDEX idx_sensor_type_timestamp ON sensor_data (sensor_type, timestamp)",
+            "CREATE INDEX idx_timestamp_covering ON sensor_data (timestamp, sensor_type, value)",
+        ],
+    ),
+    (
+        3,
+        "create hourly and daily rollups",
+        [_rollup_table(table) for table, _ in ROLLUP_TABLES.values()],
+    ),
+    (
+        4,
+        "create sensor_latest maintained by ingest",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS sensor_latest (
+                sensor_type TEXT NOT NULL PRIMARY KEY,
+                value REAL NOT NULL,
+                timestamp TIMESTAMP NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        5,
+        "partition sensor_data by month",
+        [],  # SQLite has no partitioning, retention deletes archived months instead
+    ),
+    (
+        6,
+        "add oversampling aggregates to sensor_data",
+        [  # SQLite adds one column per statement
+            "ALTER TABLE sensor_data ADD COLUMN value_mean REAL",
+            "ALTER TABLE sensor_data ADD COLUMN value_min REAL",
+            "ALTER TABLE sensor_data ADD COLUMN value_max REAL",
+            "ALTER TABLE sensor_data ADD COLUMN value_std REAL",
+            "ALTER TABLE sensor_data ADD COLUMN sample_count INTEGER",
+        ],
+    ),
+    (
+        7,
+        "add tank_id and device_id",
+        [
+            "ALTER TABLE sensor_data ADD COLUMN tank_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE sensor_data ADD COLUMN device_id TEXT NOT NULL DEFAULT 'default'",
+            "CREATE INDEX idx_tank_timestamp_covering ON sensor_data (tank_id, timestamp, sensor_type, value)",
+            # SQLite cannot change a primary key, so the keyed tables are rebuilt with tank_id
+            *_rebuild_with_tank(
+                "sensor_latest",
+                """
+                CREATE TABLE sensor_latest (
+                    tank_id TEXT NOT NULL,
+                    sensor_type TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    PRIMARY KEY (tank_id, sensor_type)
+                )
+                """,
+                "sensor_type, value, timestamp",
+            ),
+            *(
+                statement
+                for table, _ in ROLLUP_TABLES.values()
+                for statement in _rebuild_with_tank(
+                    table,
+                    f"""
+                    CREATE TABLE {table} (
+                        tank_id TEXT NOT NULL,
+                        sensor_type TEXT NOT NULL,
+                        bucket_start TIMESTAMP NOT NULL,
+                        sample_count INTEGER NOT NULL,
+                        min_value REAL NOT NULL,
+                        max_value REAL NOT NULL,
+                        sum_value REAL NOT NULL,
+                        sum_squares REAL NOT NULL,
+                        PRIMARY KEY (tank_id, sensor_type, bucket_start)
+                    )
+                    """,
+                    "sensor_type, bucket_start, sample_count, min_value, max_value, sum_value, sum_squares",
+                )
+            ),
+        ],
+    ),
+    (
+        8,
+        "drop the sensor_type index",
+        [  # latest() reads sensor_latest and range queries are per tank, so nothing reads it any more
+            "DROP INDEX IF EXISTS idx_sensor_type_timestamp",
+        ],
+    ),
+]
+
+
+class SQLiteBackend(StorageBackend):  # Readings stored in a local file (DATABASE_URL=sqlite:///path)
+    placeholder = "?"
+    explain_prefix = "EXPLAIN QUERY PLAN "
+    migrations = MIGRATIONS
+
+    # "[TIMESTAMP]" column names let the converter parse aggregated timestamps too
+    LATEST_QUERY = "SELECT tank_id, sensor_type, value, timestamp FROM sensor_latest {where}"
+    RANGE_QUERY = """
+        SELECT sensor_type, value, timestamp
+        FROM sensor_data
+        {where}
+        ORDER BY timestamp
+    """
+    EXTENT_QUERY = """
+        SELECT MIN(timestamp) AS "first [TIMESTAMP]", MAX(timestamp) AS "last [TIMESTAMP]"
+        FROM sensor_data {where}
+    """
+    NEW_ROWS_QUERY = """
+        SELECT id, sensor_type, value, timestamp
+        FROM sensor_data
+        {where}
+        ORDER BY id
+    """
+    MAX_ID_QUERY = "SELECT MAX(id) FROM sensor_data"
+    BUCKET_QUERY = """
+        SELECT sensor_type, MIN(timestamp) AS "bucket [TIMESTAMP]", AVG(value), MIN(value), MAX(value)
+        FROM sensor_data
+        {where}
+        GROUP BY sensor_type, (CAST(strftime('%s', timestamp) AS INTEGER) - CAST(strftime('%s', ?) AS INTEGER)) / ?
+        ORDER BY MIN(timestamp)
+    """
+    ROLLUP_BUCKET_QUERY = """
+        SELECT sensor_type, MIN(bucket_start) AS "bucket [TIMESTAMP]",
+               SUM(sum_value) / SUM(sample_count), MIN(min_value), MAX(max_value)
+        FROM {table}
+        {where}
+        GROUP BY sensor_type, (CAST(strftime('%s', bucket_start) AS INTEGER) - CAST(strftime('%s', ?) AS INTEGER)) / ?
+        ORDER BY MIN(bucket_start)
+    """
+    STATISTICS_QUERY = """
+        SELECT sensor_type, SUM(sample_count), MIN(min_value), MAX(max_value),
+               SUM(sum_value), SUM(sum_squares)
+        FROM {table}
+        {where}
+        GROUP BY sensor_type
+    """
+    INSERT_QUERY = f"""
+        INSERT INTO sensor_data
+            (tank_id, sensor_type, value, timestamp, device_id, {", ".join(AGGREGATE_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    LATEST_UPSERT = """
+        INSERT INTO sensor_latest (tank_id, sensor_type, value, timestamp) VALUES (?, ?, ?, ?)
+        ON CONFLICT (tank_id, sensor_type) DO UPDATE SET value = excluded.value, timestamp = excluded.timestamp
+        WHERE excluded.timestamp >= sensor_latest.timestamp
+    """
+    ROLLUP_UPSERT = """
+        INSERT INTO {table}
+            (tank_id, sensor_type, bucket_start, sample_count, min_value, max_value, sum_value, sum_squares)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tank_id, sensor_type, bucket_start) DO UPDATE SET
+            sample_count = sample_count + excluded.sample_count,
+            min_value = MIN(min_value, excluded.min_value),
+            max_value = MAX(max_value, excluded.max_value),
+            sum_value = sum_value + excluded.sum_value,
+            sum_squares = sum_squares + excluded.sum_squares
+    """
+
+    def __init__(self, url, **options):  # pool options only apply to MySQL
+        self.path = url.split(":///", 1)[1]  # sqlite:///relative.db or sqlite:////absolute/path.db
+        self._local = threading.local()  # one connection per thread
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,  # wait for the writer instead of failing with "database is locked"
+                isolation_level=None,  # autocommit, transactions are opened explicitly
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                check_same_thread=False,  # only so close() can run from the main thread
+            )
+            conn.execute("PRAGMA journal_mode=WAL")  # readers never block the ingest writer
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, fast commits
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self, time_zone=DEFAULT_TIME_ZONE):  # timestamps are always DEFAULT_TIME_ZONE
+        yield self._connect()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _range(self, start_date=None, end_date=None, column="timestamp", tank_id=None):
+        return super()._range(as_datetime(start_date), as_datetime(end_date), column, tank_id)
+
+    def latest(self, tank_id=None):
+        shift = utc_offset(LATEST_TIME_ZONE).utcoffset(None) - utc_offset(DEFAULT_TIME_ZONE).utcoffset(None)
+        return {  # shown in LATEST_TIME_ZONE like the MySQL session would
+            sensor_type: {"value": reading["value"], "timestamp": reading["timestamp"] + shift}
+            for sensor_type, reading in super().latest(tank_id).items()
+        }
+
+    def buckets(self, start_date, end_date, origin, bucket_seconds, rollup_table=None, tank_id=None):
+        return super().buckets(start_date, end_date, as_datetime(origin), bucket_seconds, rollup_table, tank_id)
+
+    def insert_readings(self, readings):
+        if not readings:
+            return
+        rows, raw_rows = reading_rows(readings, local_timestamp())  # one "now" for readings without their own
+        with query_metrics.timed("insert_readings") as record, self.connection() as conn:
+            record.rows = len(rows)
+            conn.execute("BEGIN IMMEDIATE")  # raw rows, latest values and rollups in one transaction
+            try:
+                conn.executemany(self.INSERT_QUERY, raw_rows)
+                conn.executemany(self.LATEST_UPSERT, rows)
+                for table, deltas in rollup_deltas(rows).items():
+                    conn.executemany(self.ROLLUP_UPSERT.format(table=table), deltas)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def backfill_rollups(self, start_date=None, end_date=None):  # use midnight bounds
+        where, params = self._range(start_date, end_date)
+        with self.connection() as conn, closing(conn.cursor()) as cursor:
+            for granularity, (table, _) in ROLLUP_TABLES.items():
+                bucket = BUCKET_EXPRESSIONS[granularity]
+                # Whole buckets are replaced, so running this twice gives the same result
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table}
+                        (tank_id, sensor_type, bucket_start, sample_count, min_value, max_value, sum_value, sum_squares)
+                    SELECT tank_id, sensor_type, {bucket}, COUNT(*), MIN(value), MAX(value),
+                           SUM(value), SUM(value * value)
+                    FROM sensor_data
+                    {where or "WHERE true"}
+                    GROUP BY tank_id, sensor_type, {bucket}
+                    ON CONFLICT (tank_id, sensor_type, bucket_start) DO UPDATE SET
+                        sample_count = excluded.sample_count,
+                        min_value = excluded.min_value,
+                        max_value = excluded.max_value,
+                        sum_value = excluded.sum_value,
+                        sum_squares = excluded.sum_squares
+                """,
+                    params,
+                )
+                print(f"{table}: {cursor.rowcount} rows written")
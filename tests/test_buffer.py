@@ -0,0 +1,105 @@
+# Author: Victor Vu
+# File: test_buffer.py
+# Description: Crash recovery and rejected readings of the on-disk reading buffer (python -m unittest discover tests)
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sensors"))
+from buffer import BufferFlusher, ReadingBuffer, RejectedBatch  # noqa: E402
+from connect_timer import Reading  # noqa: E402
+
+
+class ReadingBufferCrashTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "sensors.buffer")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_crash_between_truncate_and_offset_save(self):
+        buffer = ReadingBuffer(self.path)
+        buffer.append([Reading("temperature", 77.0 + i, 1700000000.0 + i) for i in range(5)])
+        readings, end = buffer.read_batch()
+        self.assertEqual(len(readings), 5)
+        buffer.commit(end // 2)  # partly flushed, the offset file now holds a non-zero offset
+
+        with mock.patch.object(ReadingBuffer, "save_offset", side_effect=OSError("power lost")):
+            with self.assertRaises(OSError):
+                buffer.commit(end)  # file emptied, offset of 0 never written
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+        restarted = ReadingBuffer(self.path)
+        self.assertEqual(restarted.offset, 0)
+        restarted.append([Reading("temperature", 80.0, 1700000100.0)])
+        readings, _ = restarted.read_batch()
+        self.assertEqual([reading.value for reading in readings], [80.0])
+        self.assertGreater(restarted.pending_bytes(), 0)
+
+    def test_drained_commit_resets_offset(self):
+        buffer = ReadingBuffer(self.path)
+        buffer.append([Reading("turbidity", 5.0, 1700000000.0)])
+        _, end = buffer.read_batch()
+        buffer.commit(end)
+        self.assertEqual((buffer.offset, buffer.pending_end()), (0, 0))
+        self.assertEqual(ReadingBuffer(self.path).offset, 0)
+
+
+class FakeSink:  # Stores all but negative values like the ingest endpoint, fails while `down` is set
+    def __init__(self):
+        self.stored, self.down = [], False
+
+    def insert_readings(self, readings):
+        if self.down:
+            raise ConnectionError("server unreachable")
+        if any(reading.sensor_type == "" for reading in readings):
+            raise RejectedBatch("400 bad request")  # the whole request refused
+        refused = [i for i, reading in enumerate(readings) if reading.value < 0]
+        self.stored.extend(reading for i, reading in enumerate(readings) if i not in refused)
+        if refused:
+            raise RejectedBatch(f"{len(refused)} readings refused", refused)
+
+
+class BufferFlusherRejectTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.buffer = ReadingBuffer(os.path.join(self.directory.name, "sensors.buffer"))
+        self.sink = FakeSink()
+        self.flusher = BufferFlusher(self.buffer, lambda: self.sink, batch_size=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rejected(self):
+        with open(self.buffer.rejected_path) as file:
+            return [json.loads(line)[1] for line in file]
+
+    def test_only_refused_readings_are_quarantined(self):
+        self.buffer.append([Reading("tds", value, 1700000000.0 + i) for i, value in enumerate([1.0, -1.0, 2.0, 3.0])])
+        self.assertEqual(self.flusher.flush(), 3)
+        self.assertEqual([reading.value for reading in self.sink.stored], [1.0, 2.0, 3.0])
+        self.assertEqual(self.rejected(), [-1.0])
+        self.assertEqual(self.buffer.pending_bytes(), 0)
+
+    def test_refused_request_quarantines_its_batch(self):
+        self.buffer.append([Reading(sensor_type, 1.0, 1700000000.0) for sensor_type in ("tds", "", "tds")])
+        self.assertEqual(self.flusher.flush(), 1)
+        self.assertEqual(self.rejected(), [1.0, 1.0])
+        self.assertEqual(self.buffer.pending_bytes(), 0)
+
+    def test_unreachable_sink_keeps_readings(self):
+        self.buffer.append([Reading("tds", 1.0, 1700000000.0)])
+        self.sink.down = True
+        self.assertEqual(self.flusher.flush(), 0)
+        self.assertGreater(self.buffer.pending_bytes(), 0)
+        self.assertFalse(os.path.exists(self.buffer.rejected_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# Author: Victor Vu and Jordan Morris
+# File: test_downsample.py
+# Description: Index and grid arithmetic of graph downsampling and deadband hold (python -m unittest discover tests)
+# Copyright (C) 2025 Victor V. Vu and Jordan Morris
+# License: GNU GPL v3 - See https://www.gnu.org/licenses/gpl-3.0.en.html
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import collect_database  # noqa: E402 (connects lazily, no database needed)
+from downsample import lttb, step_resample  # noqa: E402
+
+
+class LttbTest(unittest.TestCase):
+    def test_keeps_end_points_and_target_count(self):
+        rng = np.random.default_rng(0)
+        for n, target in ((1000, 500), (1000, 3), (101, 100), (7, 5)):
+            x = np.arange(n, dtype=np.float64)
+            indices = lttb(x, rng.normal(size=n), target)
+            self.assertEqual(len(indices), target)
+            self.assertEqual((indices[0], indices[-1]), (0, n - 1))
+            self.assertTrue(np.all(np.diff(indices) > 0))  # increasing, no point kept twice
+
+    def test_keeps_a_spike(self):
+        y = np.zeros(1000)
+        y[637] = 50.0
+        self.assertIn(637, lttb(np.arange(1000, dtype=np.float64), y, 20))
+
+    def test_short_series_is_returned_whole(self):
+        np.testing.assert_array_equal(lttb(np.arange(10.0), np.zeros(10), 10), np.arange(10))
+        np.testing.assert_array_equal(lttb(np.arange(10.0), np.zeros(10), 2), np.arange(10))
+
+
+class StepResampleTest(unittest.TestCase):
+    start = np.datetime64("2026-01-01T00:00:00", "us")
+
+    def at(self, *seconds):
+        return self.start + np.array(seconds, dtype="timedelta64[s]")
+
+    def test_holds_up_to_max_hold_then_nan(self):
+        grid, values = step_resample(self.at(0, 1800), [1.0, 2.0], 300, end=self.at(3600)[0], max_hold=900)
+        self.assertEqual(len(grid), 13)  # 0 to 3600 s inclusive
+        np.testing.assert_array_equal(grid, self.at(*range(0, 3601, 300)))
+        expected = [1.0, 1.0, 1.0, 1.0, np.nan, np.nan, 2.0, 2.0, 2.0, 2.0, np.nan, np.nan, np.nan]
+        np.testing.assert_array_equal(values, expected)  # 900 s after a reading still holds it, 1200 s does not
+
+    def test_grid_before_first_reading_is_nan(self):
+        _, values = step_resample(self.at(600), [5.0], 300, start=self.at(0)[0], max_hold=900)
+        np.testing.assert_array_equal(values, [np.nan, np.nan, 5.0])
+
+    def test_reading_between_grid_points_holds_from_the_next_one(self):
+        _, values = step_resample(self.at(0, 450), [1.0, 2.0], 300, end=self.at(900)[0])
+        np.testing.assert_array_equal(values, [1.0, 1.0, 2.0, 2.0])
+
+    def test_empty_series(self):
+        grid, values = step_resample(np.empty(0, "datetime64[us]"), [], 300)
+        self.assertEqual((len(grid), len(values)), (0, 0))
+
+
+class HoldEmptyBucketsTest(unittest.TestCase):
+    origin = datetime(2026, 1, 1)
+    bucket = 600  # seconds
+
+    def entry(self, value, seconds):
+        return {"value": value, "timestamp": self.origin + timedelta(seconds=seconds), "min": value, "max": value}
+
+    def test_fills_gaps_up_to_max_hold(self):
+        gap = int(collect_database.MAX_HOLD) // self.bucket * self.bucket  # largest whole-bucket gap still held
+        entries = [self.entry(1.0, 0), self.entry(2.0, gap)]
+        filled = collect_database.hold_empty_buckets(entries, self.origin, self.bucket)
+        self.assertEqual(len(filled), gap // self.bucket + 1)
+        self.assertEqual([entry["value"] for entry in filled], [1.0] * (gap // self.bucket) + [2.0])
+        self.assertEqual(
+            [entry["timestamp"] for entry in filled],
+            [self.origin + timedelta(seconds=i * self.bucket) for i in range(gap // self.bucket + 1)],
+        )
+
+    def test_outage_stays_empty(self):
+        gap = (int(collect_database.MAX_HOLD) // self.bucket + 1) * self.bucket  # just past MAX_HOLD
+        entries = [self.entry(1.0, 0), self.entry(2.0, gap)]
+        self.assertEqual(collect_database.hold_empty_buckets(entries, self.origin, self.bucket), entries)
+
+    def test_adjacent_buckets_are_unchanged(self):
+        entries = [self.entry(1.0, 0), self.entry(2.0, 600), self.entry(3.0, 1260)]  # mid-bucket timestamps too
+        self.assertEqual(collect_database.hold_empty_buckets(entries, self.origin, self.bucket), entries)
+
+
+if __name__ == "__main__":
+    unittest.main()